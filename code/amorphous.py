@@ -1,40 +1,26 @@
 import numpy as np
 import utilities
-from ase import Atom, neighborlist
+from ase import Atoms
+from database import as_database
+from neighbours import NeighbourGraph
 
 
-def select_disordered(p6, graphene):
+def select_disordered(p6, graphene, rng, size=None, replace=True):
     # Given a p6 value, we need to select a structure which has the closest p6 value to the desired value.
     # We need to incorporate some variance so we need to bin the p6 values and select a random structure from the bin.
 
-    p6_store = np.array([atom.info["p6"] for atom in graphene])
-    hist, bin_edges = np.histogram(p6_store, bins=100)
-    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+    # A database keeps its (sorted) p6 index between calls, a plain list of structures is indexed on every
+    # call (wrap it once with database.as_database to avoid it, as run_sweep does)
+    p6_index = as_database(graphene).p6_index
 
-    # Find the bin index with the closest p6 value to the desired value
-    bin_index = np.argmin(abs(bin_centers - p6))
+    # Find the bin with the closest p6 value to the desired value and randomly choose structures from it
+    # (a single one, or a batch of size structures drawn with or without replacement)
+    selected = p6_index.sample(p6, rng, size=size, replace=replace)
 
-    # Get all the structures falling in the selected bin
-    structures_in_bin = [
-        graphene[i]
-        for i in range(len(graphene))
-        if bin_edges[bin_index] <= p6_store[i] < bin_edges[bin_index + 1]
-    ]
-    # If there are no structures in the selected bin, return None or raise an exception
-    if not structures_in_bin:
-        # print(structures_in_bin)
-        raise ValueError("No structures found in the selected bin.")
-        # or you can return None or any other value to indicate that no structure was found
-    # If there are multiple structures with the same p6 value within the selected bin, randomly choose one
-    selected_index = np.random.randint(0, len(structures_in_bin))
-    selected_structure = structures_in_bin[selected_index]
-
-    # Find the index of the selected structure in the original graphene list
-    p6_index = graphene.index(selected_structure)
-    # Return the single atoms object with the selected structure
-    graphene = graphene[p6_index]
-
-    return graphene
+    # Return a copy of the selected structure, so the database is not modified when it is functionalised
+    if size is None:
+        return graphene[selected].copy()
+    return [graphene[i].copy() for i in selected]
 
 
 def cleave_amorphous(graphene, vacuum):
@@ -49,69 +35,85 @@ def cleave_amorphous(graphene, vacuum):
         Graphene structure
     vacuum : float
         Vacuum to be added to cell
+
+    Returns
+    -------
+    graphene_cp : ase.Atoms
+        Cleaved structure
+    nn_graph : neighbours.NeighbourGraph
+        Graph of nearest neighbours of the cleaved structure
+    removed : numpy.ndarray
+        Boolean mask of the dangling atoms removed from the structure
     """
 
     graphene_cp = graphene.copy()
 
-    # First create vacuum in x direction and then position sheet in the centre
+    # First create vacuum along the first lattice vector (x direction) and then position sheet in the centre
     positions = graphene_cp.get_positions()
     cell = graphene_cp.get_cell()
 
-    cell[0, 0] += 2 * vacuum
-    positions[:, 0] += vacuum
+    # The lattice vector is stretched along its own direction, so skewed cells keep their shape
+    direction = cell[0] / np.linalg.norm(cell[0])
+    cell[0] += 2 * vacuum * direction
+    positions += vacuum * direction
 
     graphene_cp.set_cell(cell)
     graphene_cp.set_positions(positions)
 
-    # Compute neighbor list after cleaving
-    n1, n2 = neighborlist.neighbor_list(
-        "i" "j", graphene_cp, cutoff=1.85, self_interaction=False
-    )
+    # Compute neighbour graph after cleaving
+    nn_graph = NeighbourGraph.from_atoms(graphene_cp, cutoff=1.85)
 
-    # Then we delete any dangling atom on the surface which has only one neighbour
-    coord = np.bincount(n1)
-    delete = []
-    while 1 in coord:
-        for i in range(len(coord)):
-            if coord[i] == 1:
-                delete.append(i)
-                coord[i] = 0
-                # We need to check if removing the atom creates more dangling atoms, so we look at the coordination of its neigbors
-                neighbors = n2[n1 == i]
-                for n in neighbors:
-                    coord[n] -= 1
+    # Then we delete any dangling atom on the surface which has only one neighbour (including the ones
+    # left dangling once their neighbours are deleted)
+    removed = nn_graph.prune_dangling()
 
-    graphene_cp = graphene_cp[[i for i in range(len(graphene_cp)) if i not in delete]]
+    graphene_cp = graphene_cp[~removed]
 
-    return graphene_cp
+    return graphene_cp, nn_graph.compact(), removed
 
 
-def saturate_amorphous(graphene, nn_list, box_size, CH_bond=1.09):
+def saturate_amorphous(graphene, nn_graph, CH_bond=1.09):
     """
     Summary
     ----------
-    Add rotated functional group to ribbon
+    Saturate the two-coordinated atoms of the structure with H atoms along the bisector of their bonds
 
     Parameters
     ----------
     graphene : ase.Atoms
         Graphene structure
-    nn_list : numpy.ndarray
-        Array of nearest neighbours
-    vacuum : float
-        Vacuum to be added to cell
+    nn_graph : neighbours.NeighbourGraph
+        Graph of nearest neighbours
+    CH_bond : float
+        C-H bond length
+
+    Returns
+    -------
+    graphene : ase.Atoms
+        Saturated structure
+    nn_graph : neighbours.NeighbourGraph
+        Graph of nearest neighbours including the added H atoms
     """
-    coord = np.bincount(nn_list[:, 0].T)
-    for i in range(len(coord)):
-        if coord[i] == 2:
-            neighbors = nn_list[:, 1][nn_list[:, 0] == i]
-            bond_vector_1 = graphene[neighbors[0]].position - graphene[i].position
-            bond_vector_1 = utilities.minimum_image(bond_vector_1, box_size)
-            bond_vector_2 = graphene[neighbors[1]].position - graphene[i].position
-            bond_vector_2 = utilities.minimum_image(bond_vector_2, box_size)
-            scale_factor = CH_bond / np.linalg.norm(bond_vector_1 + bond_vector_2)
-            bond_vector_ch = -1 * scale_factor * (bond_vector_1 + bond_vector_2)
-            H_pos = graphene[i].position + bond_vector_ch
-            graphene.append(Atom("H", H_pos))
-
-    return graphene
+    # Find all the two-coordinated atoms; pairs are grouped by atom, so each of them has two consecutive pairs
+    i, j = nn_graph.pairs()
+    coord = np.bincount(i, minlength=len(graphene))
+    two_coordinated = coord[i] == 2
+    saturated = i[two_coordinated][::2]
+    neighbors = j[two_coordinated].reshape(-1, 2)
+
+    # Bond vectors to both neighbours of every two-coordinated atom at once (minimum image for a general cell)
+    positions = graphene.get_positions()
+    bond_vectors = utilities.minimum_image_vectors(
+        positions[neighbors] - positions[saturated][:, None, :],
+        graphene.get_cell(),
+        graphene.pbc,
+    )
+    # H atoms are placed along the bisector pointing away from both bonds
+    bisectors = bond_vectors.sum(axis=1)
+    bond_vector_ch = -CH_bond * bisectors / np.linalg.norm(bisectors, axis=1)[:, None]
+    H_pos = positions[saturated] + bond_vector_ch
+
+    # All the H atoms are added in a single step
+    graphene.extend(Atoms("H" * len(saturated), positions=H_pos))
+
+    return graphene, nn_graph.add_atoms(saturated)
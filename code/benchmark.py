@@ -0,0 +1,485 @@
+"""_summary_
+This script benchmarks the graphene oxide builder: build.main and its individual stages are timed over a grid of
+graphene nanoribbon sizes, O contents, OH ratios and edge functionalisation (p4) values. The time and peak memory of
+every case are reported along with the scaling exponent of each stage with the number of atoms (slope of the
+log-log fit). Results can be saved as a local baseline, and later runs flag the cases which got slower than it.
+
+Usage: python benchmark.py [--quick] [--save-baseline] [--baseline benchmark_baseline.json]
+       python benchmark.py --cold-start [--cold-start-budget 1.0]
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+from itertools import product
+
+import amorphous
+import bulk_oxidation
+import buffer
+import edge_oxidation
+import groups
+import neighbours
+import numpy as np
+import spatial
+import utilities
+from ase.build import graphene_nanoribbon
+from generate_GO import build
+
+# Ribbon sizes (repeats along the ribbon and across it), from a few atoms up to a few thousand
+SIZES = ((2, 1), (5, 3), (10, 6), (20, 12), (35, 21), (50, 30))
+QUICK_SIZES = SIZES[:4]
+O_CONTENTS = (0.1, 0.3, 0.5)
+OH_RATIOS = (0.25, 0.75)
+P4_VALUES = (0.25, 0.75)
+
+SEED = 0
+MAX_ITERATIONS = 200
+
+# Single build run in a fresh interpreter (e.g. a newly started worker): the structure is passed as plain
+# arrays so that only the modules imported by the builder itself are timed
+COLD_START_SCRIPT = """
+import time
+start = time.perf_counter()
+import json, sys
+from ase import Atoms
+from generate_GO import build
+from sink import MemorySink
+imported = time.perf_counter()
+structure = json.load(sys.stdin)
+graphene = Atoms(**structure)
+build().main(graphene, 0.3, 0.5, False, 1, False, 0, (), 10, {max_iterations}, MemorySink(), seed={seed})
+print(json.dumps({{"import": imported - start, "build": time.perf_counter() - imported}}))
+"""
+
+funct_groups = groups.get("carboxyl", "aldehyde", "hydroxyl")
+
+
+def ribbon(n, m, edges=False):
+    """
+    Summary
+    ----------
+    Build the graphene structure of a benchmark case
+
+    Parameters
+    ----------
+    n : int
+        Number of repeats along the ribbon
+    m : int
+        Number of repeats across the ribbon
+    edges : bool, optional
+        If True, a hydrogen saturated ribbon with edges, otherwise a periodic sheet
+    """
+    return graphene_nanoribbon(
+        n, m, type="armchair", saturated=edges, sheet=not edges, vacuum=10
+    )
+
+
+def measure(run, setup=None, repeats=3):
+    """
+    Summary
+    ----------
+    Time a function (best of a few runs, the setup is not timed) and measure its peak memory
+    in a separate run, as tracing the allocations slows it down
+
+    Parameters
+    ----------
+    run : callable
+        Function to benchmark, called with the arguments returned by setup
+    setup : callable, optional
+        Function returning a fresh tuple of arguments for each run
+    repeats : int, optional
+        Number of timed runs, by default 3
+    """
+    setup = setup or tuple
+    times = []
+    for _ in range(repeats):
+        args = setup()
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    try:
+        run(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"time": min(times), "peak_memory": peak}
+
+
+def bulk_setup(n, m, O_content, OH_ratio):
+    # Arguments of the bulk oxidation stages for a pristine sheet, as set up by build.main
+    graphene = ribbon(n, m)
+    n_O = round(O_content * len(graphene))
+    n_OH = round(OH_ratio * n_O)
+    return {
+        "graphene": buffer.AtomBuffer(graphene),
+        "available": utilities.RandomSet(np.arange(len(graphene))),
+        "nn_graph": neighbours.NeighbourGraph.from_atoms(graphene, cutoff=1.85),
+        "index": spatial.CellList.from_atoms(
+            graphene, [], utilities.collision_thresholds().max()
+        ),
+        "n_epoxy": n_O - n_OH,
+        "n_OH": n_OH,
+        "rng": np.random.default_rng(SEED),
+    }
+
+
+def bulk_args(n, m, O_content, OH_ratio):
+    return (bulk_setup(n, m, O_content, OH_ratio),)
+
+
+def run_epoxy(case):
+    bulk_oxidation.add_epoxy_group(
+        case["graphene"],
+        case["available"],
+        case["n_epoxy"],
+        np.arange(0.1, 0.16, 0.01),
+        case["nn_graph"],
+        MAX_ITERATIONS,
+        case["index"],
+        case["rng"],
+    )
+
+
+def run_hydroxyl(case):
+    bulk_oxidation.add_hydroxyl_group(
+        case["graphene"],
+        case["available"],
+        case["n_OH"],
+        np.arange(0.1, 0.36, 0.01),
+        case["nn_graph"],
+        case["index"],
+        MAX_ITERATIONS,
+        case["rng"],
+        "continue",
+    )
+
+
+def edge_setup(n, m, p4):
+    # Arguments of add_edge_functionality for a hydrogen saturated ribbon, as set up by build.main
+    graphene = ribbon(n, m, edges=True)
+    h_atoms = np.where(graphene.numbers == 1)[0]
+    return (
+        graphene,
+        edge_oxidation.get_edge_carbons(graphene),
+        h_atoms,
+        funct_groups,
+        1.4,
+        int(p4 * len(h_atoms)),
+        np.zeros(len(graphene), dtype=bool),
+        MAX_ITERATIONS,
+        np.random.default_rng(SEED),
+    )
+
+
+def validity_setup(n, m):
+    # A hydroxyl group checked against all the O and H atoms of an oxidised sheet (worst case collision zone)
+    case = bulk_setup(n, m, 0.3, 0.5)
+    run_epoxy(case)
+    run_hydroxyl(case)
+    graphene = case["graphene"].to_atoms()
+    zone = np.where(graphene.numbers != 6)[0]
+    carbons = np.where(graphene.numbers == 6)[0][:100]
+    hydroxyl = groups.get("hydroxyl")[0]
+    placed = []
+    for carbon in carbons:
+        group = hydroxyl.to_atoms()
+        group.translate(graphene.positions[carbon] + [0, 1.49, 0])
+        placed.append(group)
+    return graphene, placed, zone
+
+
+def run_validity(graphene, placed, zone):
+    for group in placed:
+        utilities.is_structure_valid(graphene, group, zone)
+
+
+def build_setup(n, m, edges, args):
+    # build.main is given a fresh structure each run, as it modifies it
+    return ribbon(n, m, edges), args
+
+
+def run_build(graphene, args):
+    with tempfile.TemporaryDirectory() as directory:
+        build().main(
+            graphene,
+            *args,
+            MAX_ITERATIONS,
+            os.path.join(directory, "GO.xyz"),
+            seed=SEED,
+        )
+
+
+def cleave_setup(n, m):
+    return ribbon(n, m), 10
+
+
+def saturate_setup(n, m):
+    return amorphous.cleave_amorphous(ribbon(n, m), 10)[:2]
+
+
+def cold_start(repeats=5, size=(7, 5)):
+    """
+    Summary
+    ----------
+    Time a single build.main call in fresh Python processes: the import of the builder, the first build (which
+    imports the modules used lazily) and the whole process, interpreter start up included
+
+    Parameters
+    ----------
+    repeats : int, optional
+        Number of processes started, by default 5
+    size : tuple, optional
+        Size of the graphene sheet, by default 7x5 as in the example configs
+    """
+    graphene = ribbon(*size)
+    structure = json.dumps(
+        {
+            "numbers": graphene.numbers.tolist(),
+            "positions": graphene.positions.tolist(),
+            "cell": graphene.cell.tolist(),
+            "pbc": graphene.pbc.tolist(),
+        }
+    )
+    script = COLD_START_SCRIPT.format(max_iterations=MAX_ITERATIONS, seed=SEED)
+
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            input=structure,
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        total = time.perf_counter() - start
+        runs.append({**json.loads(result.stdout.splitlines()[-1]), "total": total})
+    return {
+        name: statistics.median(run[name] for run in runs)
+        for name in ("import", "build", "total")
+    }
+
+
+def cases(sizes):
+    """
+    Summary
+    ----------
+    Generate the benchmark cases: name, parameters, number of atoms, function to run and its setup
+
+    Parameters
+    ----------
+    sizes : list
+        Ribbon sizes to run over
+    """
+    for n, m in sizes:
+        size = f"{n}x{m}"
+        n_sheet = len(ribbon(n, m))
+        n_ribbon = len(ribbon(n, m, edges=True))
+
+        for O_content, OH_ratio in product(O_CONTENTS, OH_RATIOS):
+            params = {"size": size, "O_content": O_content, "OH_ratio": OH_ratio}
+            args = (O_content, OH_ratio, False, 1, False, 0, funct_groups, 10)
+            yield "build", params, n_sheet, run_build, partial(
+                build_setup, n, m, False, args
+            )
+            setup = partial(bulk_args, n, m, O_content, OH_ratio)
+            yield "add_epoxy_group", params, n_sheet, run_epoxy, setup
+            yield "add_hydroxyl_group", params, n_sheet, run_hydroxyl, setup
+
+        for p4 in P4_VALUES:
+            params = {"size": size, "p4": p4}
+            args = (0.3, 0.5, False, 1, True, p4, funct_groups, 10)
+            yield "build_edges", params, n_ribbon, run_build, partial(
+                build_setup, n, m, True, args
+            )
+            yield "add_edge_functionality", params, n_ribbon, (
+                edge_oxidation.add_edge_functionality
+            ), partial(edge_setup, n, m, p4)
+
+        # The periodic sheet is cleaved and saturated as an amorphous structure would be
+        params = {"size": size}
+        yield "cleave_amorphous", params, n_sheet, amorphous.cleave_amorphous, partial(
+            cleave_setup, n, m
+        )
+        yield "saturate_amorphous", params, n_sheet, amorphous.saturate_amorphous, partial(
+            saturate_setup, n, m
+        )
+        yield "is_structure_valid", params, n_sheet, run_validity, partial(
+            validity_setup, n, m
+        )
+
+
+def case_key(name, params):
+    return "/".join([name] + [f"{k}={v}" for k, v in params.items()])
+
+
+def scaling_exponents(results):
+    """
+    Summary
+    ----------
+    Fit the time of each stage against the number of atoms on a log-log scale, for every set of
+    parameters other than the size; the slope is the scaling exponent (1 for linear scaling)
+
+    Parameters
+    ----------
+    results : list
+        Results of the benchmark cases
+    """
+    series = {}
+    for result in results:
+        params = {k: v for k, v in result["params"].items() if k != "size"}
+        key = case_key(result["name"], params)
+        series.setdefault(key, []).append((result["n_atoms"], result["time"]))
+
+    exponents = {}
+    for key, points in series.items():
+        n_atoms, times = np.array(points).T
+        if len(points) > 1 and np.all(times > 0) and np.ptp(n_atoms) > 0:
+            exponents[key] = float(np.polyfit(np.log(n_atoms), np.log(times), 1)[0])
+    return exponents
+
+
+def compare(results, baseline, tolerance, noise=1e-3):
+    """
+    Summary
+    ----------
+    Find the cases which are slower than the baseline by more than the tolerance
+
+    Parameters
+    ----------
+    results : list
+        Results of the benchmark cases
+    baseline : dict
+        Time of each case in the baseline
+    tolerance : float
+        Allowed relative slow down (e.g. 0.2 for 20%)
+    noise : float, optional
+        Differences below this many seconds are ignored, by default 1 ms
+    """
+    regressions = []
+    for result in results:
+        reference = baseline.get(result["key"])
+        if reference is None:
+            continue
+        if (
+            result["time"] > reference * (1 + tolerance)
+            and result["time"] - reference > noise
+        ):
+            regressions.append((result["key"], reference, result["time"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--quick", action="store_true", help="only run the smaller ribbon sizes"
+    )
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per case")
+    parser.add_argument(
+        "--filter", default="", help="only run the cases whose name contains this"
+    )
+    parser.add_argument(
+        "--baseline",
+        default="benchmark_baseline.json",
+        help="local baseline file (not committed)",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store the results as the new baseline",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="relative slow down flagged as a regression",
+    )
+    parser.add_argument("--output", help="write the full results to this JSON file")
+    parser.add_argument(
+        "--cold-start",
+        action="store_true",
+        help="only time a single build in fresh processes (worker start up)",
+    )
+    parser.add_argument(
+        "--cold-start-budget",
+        type=float,
+        default=1.0,
+        help="median seconds allowed for a cold start build, process start up included",
+    )
+    args = parser.parse_args()
+
+    if args.cold_start:
+        timings = cold_start(args.repeats)
+        print(
+            f"Cold start (median of {args.repeats}): import {timings['import']:.3f} s, "
+            f"first build {timings['build']:.3f} s, process {timings['total']:.3f} s "
+            f"(budget {args.cold_start_budget:.3f} s)"
+        )
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"cold_start": timings}, f, indent=2)
+        return int(timings["total"] > args.cold_start_budget)
+
+    # The builder only reports warnings and progress, which are not wanted here
+    logging.disable(logging.WARNING)
+
+    results = []
+    for name, params, n_atoms, run, setup in cases(
+        QUICK_SIZES if args.quick else SIZES
+    ):
+        if args.filter not in name:
+            continue
+        result = measure(run, setup, args.repeats)
+        result.update(
+            name=name, params=params, n_atoms=n_atoms, key=case_key(name, params)
+        )
+        results.append(result)
+        print(
+            f"{result['key']:<60} {n_atoms:>6} atoms {result['time']*1e3:>10.2f} ms "
+            f"{result['peak_memory']/2**20:>8.2f} MiB"
+        )
+
+    exponents = scaling_exponents(results)
+    print("\nScaling exponents (time ~ N_atoms^k)")
+    for key, exponent in exponents.items():
+        print(f"{key:<60} k = {exponent:.2f}")
+
+    exit_code = 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        print(f"\n{len(regressions)} regressions against {args.baseline}")
+        for key, reference, elapsed in regressions:
+            print(
+                f"REGRESSION {key}: {reference*1e3:.2f} ms -> {elapsed*1e3:.2f} ms "
+                f"({elapsed/reference:.2f}x)"
+            )
+        exit_code = 1 if regressions else 0
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({r["key"]: r["time"] for r in results}, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results, "scaling": exponents}, f, indent=2)
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,143 @@
+import numpy as np
+from ase import Atoms
+
+
+class AtomBuffer:
+    """
+    Summary
+    ----------
+    Staging buffer for the atoms added during oxidation. Positions and atomic numbers are kept in
+    preallocated arrays which grow geometrically, so appending an atom (or rolling back rejected ones)
+    does not copy the whole structure as ase.Atoms.append and del do. The structure is materialised into
+    an ase.Atoms object once all the atoms have been added.
+
+    Parameters
+    ----------
+    atoms : ase.Atoms
+        Structure the atoms are added to
+    """
+
+    def __init__(self, atoms):
+        self.atoms = atoms
+        self.n_initial = len(atoms)
+        self.n_atoms = len(atoms)
+
+        capacity = max(2 * self.n_atoms, 64)
+        self._positions = np.zeros((capacity, 3))
+        self._numbers = np.zeros(capacity, dtype=int)
+        self._positions[: self.n_atoms] = atoms.get_positions()
+        self._numbers[: self.n_atoms] = atoms.numbers
+
+        # Cell and periodicity are needed for collision checking
+        self.pbc = atoms.pbc.copy()
+        self._cell = atoms.get_cell()
+
+    def __len__(self):
+        return self.n_atoms
+
+    @property
+    def positions(self):
+        # View of the positions of the atoms currently in the buffer (invalidated when the buffer grows)
+        return self._positions[: self.n_atoms]
+
+    @property
+    def numbers(self):
+        return self._numbers[: self.n_atoms]
+
+    def get_positions(self):
+        return self.positions
+
+    def get_cell(self):
+        return self._cell
+
+    def append(self, number, position):
+        """
+        Summary
+        ----------
+        Append an atom to the buffer
+
+        Parameters
+        ----------
+        number : int
+            Atomic number of the atom
+        position : numpy.ndarray
+            Position of the atom
+
+        Returns
+        -------
+        int
+            Index of the added atom
+        """
+        if self.n_atoms == len(self._numbers):
+            # Double the capacity, so that appending is amortised O(1)
+            self._positions = np.concatenate([self._positions, self._positions])
+            self._numbers = np.concatenate([self._numbers, self._numbers])
+        self._positions[self.n_atoms] = position
+        self._numbers[self.n_atoms] = number
+        self.n_atoms += 1
+        return self.n_atoms - 1
+
+    def extend(self, numbers, positions):
+        """
+        Summary
+        ----------
+        Append several atoms to the buffer at once
+
+        Parameters
+        ----------
+        numbers : numpy.ndarray
+            Atomic numbers of the atoms
+        positions : numpy.ndarray
+            Positions of the atoms
+
+        Returns
+        -------
+        numpy.ndarray
+            Indices of the added atoms
+        """
+        n_new = len(numbers)
+        capacity = len(self._numbers)
+        if self.n_atoms + n_new > capacity:
+            capacity = max(2 * capacity, self.n_atoms + n_new)
+            self._positions = np.concatenate(
+                [self._positions, np.zeros((capacity - len(self._numbers), 3))]
+            )
+            self._numbers = np.concatenate(
+                [self._numbers, np.zeros(capacity - len(self._numbers), dtype=int)]
+            )
+        new = np.arange(self.n_atoms, self.n_atoms + n_new)
+        self._positions[new] = positions
+        self._numbers[new] = numbers
+        self.n_atoms += n_new
+        return new
+
+    def truncate(self, n_atoms):
+        """
+        Summary
+        ----------
+        Roll back the buffer to its first n_atoms atoms, removing the ones appended afterwards
+
+        Parameters
+        ----------
+        n_atoms : int
+            Number of atoms to keep
+        """
+        if n_atoms < self.n_initial:
+            raise ValueError("Cannot remove atoms of the original structure")
+        self.n_atoms = n_atoms
+
+    def to_atoms(self):
+        """
+        Summary
+        ----------
+        Build the ase.Atoms object with the (possibly moved) original atoms followed by all the added atoms
+        """
+        atoms = self.atoms.copy()
+        atoms.set_positions(self._positions[: self.n_initial])
+        atoms.extend(
+            Atoms(
+                numbers=self._numbers[self.n_initial : self.n_atoms],
+                positions=self._positions[self.n_initial : self.n_atoms],
+            )
+        )
+        return atoms
@@ -1,193 +1,266 @@
+import logging
+
 import numpy as np
+import profiling
 import utilities
-from ase import Atom
 
-user_asked = False
+logger = logging.getLogger(__name__)
+
+# What to do once the structure grows larger than the size budget (out of range of DFT):
+# warn once and carry on, stop adding hydroxyl groups, or carry on silently
+SIZE_POLICIES = ("warn", "stop", "continue")
+
+# How the hydroxyl groups are placed: one group at a time, or a batch of groups per round with the clashes
+# resolved for the whole batch at once (much faster for large structures)
+PLACEMENTS = ("sequential", "batch")
+
+
+def propose_epoxy_bonds(available, nn_graph, rng):
+    """
+    Summary
+    ----------
+    Propose a set of non-conflicting C-C bonds to epoxidise, i.e. a random matching on the bonds between
+    carbon atoms which have not been oxidised yet. Each candidate bond gets a random priority and is kept
+    if it has the lowest priority of all the candidate bonds at both of its atoms, so no atom is in more
+    than one kept bond.
+
+    Parameters
+    ----------
+    available : utilities.RandomSet
+        Indices of the carbon atoms which have not been oxidised yet
+    nn_graph : neighbours.NeighbourGraph
+        Graph of nearest neighbours
+    rng : numpy.random.Generator
+        Random number generator
+
+    Returns
+    -------
+    carbons, neighbours : numpy.ndarray
+        Atoms of the proposed bonds, empty if there are no bonds left between available carbon atoms
+    """
+    i, j = nn_graph.pairs()
+    # Each bond is listed once, between two carbon atoms which can still be oxidised
+    candidate = (i < j) & available.isin(i) & available.isin(j)
+    i, j = i[candidate], j[candidate]
+
+    priority = rng.random(len(i))
+    lowest = np.full(len(nn_graph), np.inf)
+    np.minimum.at(lowest, i, priority)
+    np.minimum.at(lowest, j, priority)
+    accepted = (priority == lowest[i]) & (priority == lowest[j])
+
+    # Bonds are returned in random order, so that taking the first few is a random subset
+    order = rng.permutation(np.count_nonzero(accepted))
+    return i[accepted][order], j[accepted][order]
 
 
 def add_epoxy_group(
     graphene,
-    oxidised_atoms,
+    available,
     n_epoxy,
     buckling_epoxy,
-    n_O,
-    n_OH,
-    N_atoms,
-    nn_list,
-    box_size,
+    nn_graph,
     max_iterations,
+    index,
+    rng,
+    stats=None,
 ):
     """_summary_
-    Add an epoxy group to the graphene structure
+    Add the epoxy groups to the graphene structure. Epoxides are placed in rounds, each adding a batch of
+    non-conflicting C-C bonds (see propose_epoxy_bonds) at once.
 
     Parameters
     ----------
-    graphene : ase.Atoms
-        Graphene structure
-    oxidised_atoms: list
-        List of the indices of the carbon atoms which have been oxidized
+    graphene : buffer.AtomBuffer
+        Graphene structure (staged atoms)
+    available : utilities.RandomSet
+        Indices of the carbon atoms which have not been oxidised yet
     n_epoxy : int
         Number of epoxy groups to add
     buckling_epoxy : list
         List of buckling heights for the epoxy groups
-    n_O : int
-        Number of oxygen atoms to add
-    n_OH : int
-        Number of hydroxyl groups to add
-    N_atoms : int
-        Number of atoms in the graphene structure
-    nn_list : numpy.ndarray
-        Array of nearest neighbours
-    box_size : float
-        Size of the box
+    nn_graph : neighbours.NeighbourGraph
+        Graph of nearest neighbours
     max_iterations : int
-        Maximum number of iterations to try and add an epoxy group
+        Maximum number of rounds of epoxy groups to add
+    index : spatial.CellList
+        Spatial index of the added O and H atoms (used for collision checking)
+    rng : numpy.random.Generator
+        Random number generator
+    stats : profiling.Stats, optional
+        Counters of the build, updated with the attempts, rejections and collision checks
     """
-    # We are going to keep track of which carbons is the added oxygen close to(useful for collision checking)
-    close_positions_up = []
-    close_positions_down = []
-
+    if stats is None:
+        stats = profiling.Stats()
+    progress = profiling.Progress(logger, "epoxy groups", n_epoxy)
     n_added = 0  # number of epoxy groups added
+    rounds = 0
     while n_added < n_epoxy:
-        # Choose a random carbon atom and its neighbour
-        (
-            graphene,
-            oxidised_atoms,
-            carbon_atom,
-            neighbour,
-            iterations,
-        ) = pick_random_carbon(
-            graphene,
-            oxidised_atoms,
-            N_atoms,
-            nn_list,
-            max_iterations,
-            epoxy=True,
-        )
-        if carbon_atom is None and neighbour is None and iterations < max_iterations:
-            pass
-        elif carbon_atom is None and neighbour is None and iterations == max_iterations:
-            print(
-                f"Could not add {n_epoxy} epoxy groups as there are no more carbon atoms to oxidize."
+        if rounds == max_iterations:
+            stats.count("max_iteration_exits")
+            logger.warning(
+                "Maximum iterations reached for epoxy. Check your structure to ensure it is correct"
             )
             break
-        else:
-            bond_vector = graphene[neighbour].position - graphene[carbon_atom].position
-            bond_vector = utilities.minimum_image(bond_vector, box_size)
-            midpoint = graphene[carbon_atom].position + bond_vector / 2
-
-            # Add the oxygen atom (bond length of ~1.46 Angstroms, so ~1.26 Ang above the midpoint - https://arxiv.org/abs/1102.3797)
-            # Calculate using basic trigonometry and we will place either above or below the midpoint
-
-            rand = np.random.random()
-
-            if rand < 0.5:
-                graphene[carbon_atom].position += [
-                    0,
-                    np.random.choice(buckling_epoxy),
-                    0,
-                ]
-
-                graphene[neighbour].position += [
-                    0,
-                    -1 * np.random.choice(buckling_epoxy),
-                    0,
-                ]
-
-                graphene.append(Atom("O", midpoint + [0, 1.26, 0]))
-                # We are going to say that the neighbours of the oxidised atoms to the close to the added epoxide, so that
-                # if we oxidese any of them we know to check for a collisions between the OH and the epoxide
-                # also we have seperate arrays for the top and the bottom oxygens
-                for pair in nn_list:
-                    if (
-                        (pair[0] == carbon_atom or pair[0] == neighbour)
-                        and pair[1] != carbon_atom
-                        and pair[1] != neighbour
-                    ):
-                        close_positions_up.append([pair[1], len(graphene) - 1])
-
-            elif rand >= 0.5:
-                graphene[carbon_atom].position += [
-                    0,
-                    -1 * np.random.choice(buckling_epoxy),
-                    0,
-                ]
-
-                graphene[neighbour].position += [0, np.random.choice(buckling_epoxy), 0]
-
-                graphene.append(Atom("O", midpoint + [0, -1.26, 0]))
+        rounds += 1
+
+        # Choose a batch of random carbon atoms and their neighbours, only as many as still needed
+        carbon_atoms, neighbours = propose_epoxy_bonds(available, nn_graph, rng)
+        if len(carbon_atoms) == 0:
+            logger.warning(
+                "Could not add %d epoxy groups as there are no more carbon atoms to oxidize.",
+                n_epoxy - n_added,
+            )
+            break
+        carbon_atoms = carbon_atoms[: n_epoxy - n_added]
+        neighbours = neighbours[: n_epoxy - n_added]
+        n_batch = len(carbon_atoms)
+        stats.count("epoxy_attempts", n_batch)
+
+        bond_vectors = graphene.positions[neighbours] - graphene.positions[carbon_atoms]
+        bond_vectors = utilities.minimum_image_vectors(
+            bond_vectors, graphene.get_cell(), graphene.pbc
+        )
+        midpoints = graphene.positions[carbon_atoms] + bond_vectors / 2
+
+        # Add the oxygen atom (bond length of ~1.46 Angstroms, so ~1.26 Ang above the midpoint - https://arxiv.org/abs/1102.3797)
+        # Calculate using basic trigonometry and we will place either above or below the midpoint
+        side = np.where(rng.random(n_batch) < 0.5, 1.0, -1.0)
+        buckling = rng.choice(buckling_epoxy, size=(n_batch, 2))
+
+        # The carbon atom is buckled towards the oxygen and its neighbour away from it
+        graphene.positions[carbon_atoms, 1] += side * buckling[:, 0]
+        graphene.positions[neighbours, 1] -= side * buckling[:, 1]
+        midpoints[:, 1] += side * 1.26
+        O_indices = graphene.extend(np.full(n_batch, 8), midpoints)
+
+        # Remove oxidised carbon atoms from the available ones so we dont try and epoxy/hydroxyl group them again
+        for atom in np.concatenate([carbon_atoms, neighbours]).tolist():
+            available.remove(atom)
+
+        # Register the epoxides in the spatial index, so that any hydroxyl group placed
+        # close to them later on is checked for collisions with them
+        for O_index, position in zip(O_indices.tolist(), midpoints):
+            index.add(O_index, position)
+        n_added += n_batch
+        progress.update(n_added)
+    progress.finish(n_added)
+    return graphene, available, n_added
+
+
+def apply_size_policy(size_policy, max_atoms):
+    """
+    Summary
+    ----------
+    Apply the size policy once the structure has grown larger than the size budget
 
-                for pair in nn_list:
-                    if (
-                        (pair[0] == carbon_atom or pair[0] == neighbour)
-                        and pair[1] != carbon_atom
-                        and pair[1] != neighbour
-                    ):
-                        close_positions_down.append([pair[1], len(graphene) - 1])
-            # Add print statement saying we have added x % of the oxygen atoms
-            n_added += 1
-            print(f"Added {n_added} epoxy groups ({n_added/(n_O-n_OH)*100:.2f}%)")
-    return graphene, oxidised_atoms, n_added, close_positions_up, close_positions_down
+    Parameters
+    ----------
+    size_policy : str
+        What to do when the structure exceeds max_atoms, one of SIZE_POLICIES
+    max_atoms : int
+        Size budget of the structure
+
+    Returns
+    -------
+    bool
+        True if no more groups should be added
+    """
+    if size_policy == "stop":
+        logger.warning(
+            "Structure is larger than %d atoms and will be out of range of DFT. "
+            "Stopping - Consider reducing the O content",
+            max_atoms,
+        )
+        return True
+    if size_policy == "warn":
+        logger.warning(
+            "Structure is larger than %d atoms and will be out of range of DFT. Continuing",
+            max_atoms,
+        )
+    return False
 
 
 def add_hydroxyl_group(
     graphene,
-    oxidised_atoms,
+    available,
     n_OH,
     buckling_OH,
-    N_atoms,
-    nn_list,
-    close_positions_up,
-    close_positions_down,
+    nn_graph,
+    index,
     max_iterations,
+    rng,
+    size_policy="warn",
+    max_atoms=300,
+    stats=None,
 ):
     """_summary_
     Add a hydroxyl group to the graphene structure. Need to make sure we don't add a hydroxyl group to a carbon atom that already has an epoxy group.
 
     Parameters
     ----------
-    graphene : ase.Atoms
-        Graphene structure
-    oxidised_atoms : list
-        List of the indices of the carbon atoms which have been oxidized
+    graphene : buffer.AtomBuffer
+        Graphene structure (staged atoms)
+    available : utilities.RandomSet
+        Indices of the carbon atoms which have not been oxidised yet
     n_OH : int
         Number of hydroxyl groups to add
     buckling_OH : list
         List of buckling heights for the hydroxyl groups
-    N_atoms : int
-        Number of atoms in the graphene structure
-    nn_list : numpy.ndarray
-        Array of nearest neighbours
-    close_positions_up: np.ndarray
-        Array of pairs of a carbon atom and nearby oxygen pointing up (used for collision checking)
-        close_positions_down: np.ndarray
-        Array of pairs of a carbon atom and nearby oxygen pointing down (used for collision checking)
+    nn_graph : neighbours.NeighbourGraph
+        Graph of nearest neighbours
+    index : spatial.CellList
+        Spatial index of the added O and H atoms (used for collision checking)
     max_iterations : int
-        Maximum number of iterations to try and add a hydroxyl group
+        Maximum number of carbon atoms to try for each hydroxyl group, and of placements rejected in a row
+    rng : numpy.random.Generator
+        Random number generator
+    size_policy : str, optional
+        What to do when the structure exceeds max_atoms, one of SIZE_POLICIES, by default "warn"
+    max_atoms : int, optional
+        Size budget of the structure, by default 300 atoms
+    stats : profiling.Stats, optional
+        Counters of the build, updated with the attempts, rejections and collision checks
     """
+    if stats is None:
+        stats = profiling.Stats()
+    progress = profiling.Progress(logger, "hydroxyl groups", n_OH)
     n_added = 0
+    size_checked = False
+    # Rejected placements since the last group was added, if the carbon atoms left can never take a group
+    # without a clash this is what ends the search
+    rejected = 0
     # Add the oxygen atoms above a carbon atom (hydroxyl groups)
     while n_added < n_OH:
+        if rejected == max_iterations:
+            stats.count("max_iteration_exits")
+            logger.warning(
+                "Maximum iterations reached for hydroxyl, %d placements in a row were rejected. "
+                "Check your structure to ensure it is correct",
+                rejected,
+            )
+            break
+
         # Choose a random carbon atom that doesn't already have an epoxy group
         (
             graphene,
-            oxidised_atoms,
+            available,
             carbon_atom,
             neighbour,
             iterations,
         ) = pick_random_carbon(
-            graphene, oxidised_atoms, N_atoms, nn_list, max_iterations
+            graphene, available, nn_graph, max_iterations, rng, stats=stats
         )
 
-        if carbon_atom is None and iterations < max_iterations:
-            pass
-        elif carbon_atom is None and iterations == max_iterations:
-            print(
-                f"Could not add {n_OH-n_added} hydroxyl groups as there are no more carbon atoms to oxidize"
+        if carbon_atom is None:
+            logger.warning(
+                "Could not add %d hydroxyl groups as there are no more carbon atoms to oxidize",
+                n_OH - n_added,
             )
             break
 
         else:
+            stats.count("hydroxyl_attempts")
             # Hydroxyl groups added as first O and then H attached to it.
             # In both cases, it is critical to make sure that added atom is not in an unreasonably
             # close contact with other atoms. Below, check O atoms are positioned at least 1.85 Ang away
@@ -195,54 +268,36 @@ def add_hydroxyl_group(
 
             # Add the oxygen atom (bond lentgh of 1.49 Angstroms) either above or below the carbon atom
 
-            rand = np.random.random()
-
-            # buckling_OH = np.random.choice(buckling_OH)
+            rand = rng.random()
 
+            # The buckling is kept so that it can be undone exactly if the group is rejected
             if rand < 0.5:
-                graphene[carbon_atom].position += [0, np.random.choice(buckling_OH), 0]
-                oxygen_pos = graphene[carbon_atom].position + [0, 1.49, 0]
-                # get the collision zone of the added oxygen by looking at which oxygens are close to the oxidised C
-                collision_zone = [
-                    j[1] for j in close_positions_up if j[0] == carbon_atom
-                ]
+                buckling = rng.choice(buckling_OH)
+                graphene.positions[carbon_atom] += [0, buckling, 0]
+                oxygen_pos = graphene.positions[carbon_atom] + [0, 1.49, 0]
 
             elif rand >= 0.5:
-                graphene[carbon_atom].position += [
-                    0,
-                    -1 * np.random.choice(buckling_OH),
-                    0,
-                ]
-                oxygen_pos = graphene[carbon_atom].position + [0, -1.49, 0]
-                collision_zone = [
-                    j[1] for j in close_positions_down if j[0] == carbon_atom
-                ]
-
-            graphene.append(Atom("O", oxygen_pos))
-            # If O of OH is close to other O atoms, delete OH and repeat search
+                buckling = -1 * rng.choice(buckling_OH)
+                graphene.positions[carbon_atom] += [0, buckling, 0]
+                oxygen_pos = graphene.positions[carbon_atom] + [0, -1.49, 0]
+
+            # Get the collision zone of the added oxygen by looking up the O and H atoms already close to it
+            collision_zone = index.query(oxygen_pos)
 
-            O_index = len(graphene) - 1
+            O_index = graphene.append(8, oxygen_pos)
+            # If O of OH is close to other O atoms, delete OH and repeat search
 
             # Check if structure is valid, i.e. if there are close contacts
-            # Added oxygen atom is given as a an array (function originally was built for adding multi-atom groups)
-            if utilities.is_structure_valid(graphene, [graphene[-1]], collision_zone):
-                pass
-            else:
-                # If O is too close to other O atoms we delete it and undo the buckling
-                del graphene[O_index]
-
-                if rand < 0.5:
-                    graphene[carbon_atom].position += [
-                        0,
-                        -1 * np.random.choice(buckling_OH),
-                        0,
-                    ]
-                elif rand >= 0.5:
-                    graphene[carbon_atom].position += [
-                        0,
-                        np.random.choice(buckling_OH),
-                        0,
-                    ]
+            # Added oxygen atom is given as a single placement of a one atom group
+            stats.count("collision_checks")
+            if not utilities.valid_placements(
+                graphene, [[oxygen_pos]], [8], collision_zone
+            )[0]:
+                # If O is too close to other O atoms we roll it back and undo the buckling
+                graphene.truncate(O_index)
+                graphene.positions[carbon_atom] -= [0, buckling, 0]
+                stats.count("hydroxyl_rejections")
+                rejected += 1
 
                 continue
 
@@ -251,14 +306,14 @@ def add_hydroxyl_group(
 
             bond_OH = 0.98
 
-            theta_deg = 100.0 + np.random.random() * 15.0
+            theta_deg = 100.0 + rng.random() * 15.0
 
             if rand < 0.5:
                 theta = np.deg2rad(180 - theta_deg)
             elif rand >= 0.5:
                 theta = np.deg2rad(theta_deg)
 
-            phi = np.deg2rad(np.random.random() * 360.0)
+            phi = np.deg2rad(rng.random() * 360.0)
 
             # Spherical to cartesian, add random orientation for OH
 
@@ -267,150 +322,314 @@ def add_hydroxyl_group(
             z = bond_OH * np.sin(theta) * np.sin(phi)
 
             H_pos = oxygen_pos + [x, y, z]
-            graphene.append(Atom("H", H_pos))
+            collision_zone = index.query(H_pos)
+            H_index = graphene.append(1, H_pos)
 
             # Repeat the same collision zone analysis for the H atoms
             # If H of OH is close to other atoms, delete OH and repeat search
-            H_index = len(graphene) - 1
-
-            if utilities.is_structure_valid(graphene, [graphene[-1]], collision_zone):
-                oxidised_atoms.append(carbon_atom)
+            stats.count("collision_checks")
+            if utilities.valid_placements(graphene, [[H_pos]], [1], collision_zone)[0]:
+                available.remove(carbon_atom)
                 n_added += 1
+                rejected = 0
 
-                # Close C and O list is updated with new OH group
-                # First we get the nearest neighbours of the oxidised carbon
-                first_neighbors = nn_list[:, 1][nn_list[:, 0] == carbon_atom]
-                # Then we want to collect the neighbours of the first neighbors as well
-                second_neighbors = np.array([])
-                for n in first_neighbors:
-                    second_neighbors = np.concatenate(
-                        [second_neighbors, nn_list[:, 1][nn_list[:, 0] == n]]
-                    )
-                    # close_positions_up.append([n, O_index])
-                # We remove the duplicate second neighbours and also we removed the oxidised carbon
-                second_neighbors = np.unique(second_neighbors)
-                second_neighbors = second_neighbors[second_neighbors != carbon_atom]
-                # now append selected C oxidized C list
-
-                # collect first and second neighbors together
-                # second_neighbors = second_neighbors.astype(int)
-                neighbors = np.concatenate([first_neighbors, second_neighbors]).astype(
-                    int
-                )
-
-                if rand < 0.5:
-                    for n in neighbors:
-                        close_positions_up.append([n, O_index])
-                        close_positions_up.append([n, H_index])
-                elif rand >= 0.5:
-                    for n in neighbors:
-                        close_positions_down.append([n, O_index])
-                        close_positions_down.append([n, H_index])
+                # Spatial index is updated with new OH group
+                index.add(O_index, oxygen_pos)
+                index.add(H_index, H_pos)
             else:
-                del graphene[H_index]
-                del graphene[H_index - 1]
-
-                if rand < 0.5:
-                    graphene[carbon_atom].position += [
-                        0,
-                        -1 * np.random.choice(buckling_OH),
-                        0,
-                    ]
-
-                elif rand >= 0.5:
-                    graphene[carbon_atom].position += [
-                        0,
-                        np.random.choice(buckling_OH),
-                        0,
-                    ]
-
-            print(f"Added {n_added} hydroxyl groups ({n_added/(n_OH)*100:.2f}%)")
-            global user_asked
-            if len(graphene) > 300 and user_asked == False:
-                # stop the code and ask the user if they want to continue. if they do, then we will continue for the remainder of the entire code
-                # if they don't then we will stop the code
-                print(
-                    "WARNING: Structure is getting large and will be out of range of DFT. Do you want to continue?"
-                )
-                user_input = input("Enter y to continue, anything else to stop: ")
-                if user_input == "y":
-                    user_asked = True  # Set the flag to True, so it won't ask again
-                else:
-                    print("Stopping code - Consider reducing the O content")
+                # Roll back both the O and H atoms and undo the buckling
+                graphene.truncate(O_index)
+                graphene.positions[carbon_atom] -= [0, buckling, 0]
+                stats.count("hydroxyl_rejections")
+                rejected += 1
+
+            progress.update(n_added)
+            if len(graphene) > max_atoms and not size_checked:
+                # The size policy is only applied once per structure
+                size_checked = True
+                if apply_size_policy(size_policy, max_atoms):
                     break
-    return graphene, oxidised_atoms, n_added
+    progress.finish(n_added)
+    return graphene, available, n_added
+
+
+def propose_hydroxyl_sites(available, nn_graph, rng):
+    """
+    Summary
+    ----------
+    Propose a set of carbon atoms to add hydroxyl groups to, along with the side of the sheet of each group.
+    Candidates are the available carbon atoms with an available neighbour (as in pick_random_carbon).
+    Neighbouring hydroxyl groups on the same side of the sheet always clash, so each candidate gets a
+    random priority and is kept if it has the lowest priority of its same side neighbours (a random
+    independent set).
+
+    Parameters
+    ----------
+    available : utilities.RandomSet
+        Indices of the carbon atoms which have not been oxidised yet
+    nn_graph : neighbours.NeighbourGraph
+        Graph of nearest neighbours
+    rng : numpy.random.Generator
+        Random number generator
+
+    Returns
+    -------
+    carbons : numpy.ndarray
+        Proposed carbon atoms, in random order
+    sides : numpy.ndarray
+        Side of the sheet of each group (+1 or -1)
+    """
+    i, j = nn_graph.pairs()
+    bonded = available.isin(i) & available.isin(j)
+    candidate = np.zeros(len(nn_graph), dtype=bool)
+    candidate[i[bonded]] = True
+
+    priority = rng.random(len(nn_graph))
+    sides = np.where(rng.random(len(nn_graph)) < 0.5, 1.0, -1.0)
 
+    # Lowest priority among the same side neighbours of each candidate
+    conflict = bonded & (sides[i] == sides[j])
+    lowest = np.full(len(nn_graph), np.inf)
+    np.minimum.at(lowest, i[conflict], priority[j[conflict]])
+    accepted = np.where(candidate & (priority < lowest))[0]
 
-def pick_random_carbon(
-    graphene, oxidised_atoms, N_atoms, nn_list, max_iterations, epoxy=False
+    order = rng.permutation(len(accepted))
+    return accepted[order], sides[accepted[order]]
+
+
+def find_clashing_groups(graphene, index, group_positions, group_numbers):
+    """
+    Summary
+    ----------
+    Check a batch of new groups for close contacts with the atoms in the spatial index and with each other,
+    all at once. When two new groups clash, the one later in the batch is rejected.
+
+    Parameters
+    ----------
+    graphene : buffer.AtomBuffer
+        Graphene structure (staged atoms)
+    index : spatial.CellList
+        Spatial index of the added O and H atoms (used for collision checking)
+    group_positions : numpy.ndarray
+        Positions of the atoms of each new group, shape (N_groups, N_group_atoms, 3)
+    group_numbers : numpy.ndarray
+        Atomic numbers of the group atoms
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask which is True for each rejected group
+    """
+    n_groups, n_group_atoms = group_positions.shape[:2]
+    positions = group_positions.reshape(-1, 3)
+    numbers = np.tile(group_numbers, n_groups)
+    groups = np.repeat(np.arange(n_groups), n_group_atoms)
+    thresholds = utilities.collision_thresholds()
+    cell = graphene.get_cell()
+
+    # Clashes with the atoms already in the structure
+    new, old = index.query_many(positions)
+    distances = utilities.minimum_image_distances(
+        positions[new] - graphene.positions[old], cell, graphene.pbc
+    )
+    clash = distances <= thresholds[numbers[new], graphene.numbers[old]]
+    rejected = np.zeros(n_groups, dtype=bool)
+    rejected[groups[new[clash]]] = True
+
+    # Clashes between the new groups, the group later in the batch is the one rejected
+    new, other = index.query_many(
+        positions, stored=(np.arange(len(positions)), positions)
+    )
+    later = groups[other] < groups[new]
+    new, other = new[later], other[later]
+    distances = utilities.minimum_image_distances(
+        positions[new] - positions[other], cell, graphene.pbc
+    )
+    clash = distances <= thresholds[numbers[new], numbers[other]]
+    rejected[groups[new[clash]]] = True
+    return rejected
+
+
+def add_hydroxyl_groups_batch(
+    graphene,
+    available,
+    n_OH,
+    buckling_OH,
+    nn_graph,
+    index,
+    max_iterations,
+    rng,
+    size_policy="warn",
+    max_atoms=300,
+    stats=None,
 ):
     """_summary_
-    Pick a random carbon atom and its neighbour
+    Add the hydroxyl groups to the graphene structure in rounds. Each round proposes all the groups still
+    needed at once (see propose_hydroxyl_sites), checks them for clashes in one go and keeps the valid ones.
+    The carbon atoms of the rejected groups stay available, and each round draws a new set of sites from
+    all the available carbon atoms.
 
     Parameters
     ----------
-    graphene : ase.Atoms
-        Graphene structure
-    oxidised_atoms : list
-        List of the indices of the carbon atoms which have been oxidized
-    N_atoms : int
-        Number of atoms in the graphene structure
-    nn_list : numpy.ndarray
-        Array of nearest neighbours
-    epoxy : bool, optional
-        If True, then we are adding an epoxy group, by default False
+    graphene : buffer.AtomBuffer
+        Graphene structure (staged atoms)
+    available : utilities.RandomSet
+        Indices of the carbon atoms which have not been oxidised yet
+    n_OH : int
+        Number of hydroxyl groups to add
+    buckling_OH : list
+        List of buckling heights for the hydroxyl groups
+    nn_graph : neighbours.NeighbourGraph
+        Graph of nearest neighbours
+    index : spatial.CellList
+        Spatial index of the added O and H atoms (used for collision checking)
+    max_iterations : int
+        Maximum number of rounds of hydroxyl groups to add
+    rng : numpy.random.Generator
+        Random number generator
+    size_policy : str, optional
+        What to do when the structure exceeds max_atoms, one of SIZE_POLICIES, by default "warn"
+    max_atoms : int, optional
+        Size budget of the structure, by default 300 atoms
+    stats : profiling.Stats, optional
+        Counters of the build, updated with the attempts, rejections and collision checks
     """
+    if stats is None:
+        stats = profiling.Stats()
+    progress = profiling.Progress(logger, "hydroxyl groups", n_OH)
+    n_added = 0
+    rounds = 0
+    size_checked = False
+    while n_added < n_OH:
+        if rounds == max_iterations:
+            stats.count("max_iteration_exits")
+            logger.warning(
+                "Maximum iterations reached for hydroxyl. Check your structure to ensure it is correct"
+            )
+            break
+        rounds += 1
+
+        carbon_atoms, sides = propose_hydroxyl_sites(available, nn_graph, rng)
+        if len(carbon_atoms) == 0:
+            logger.warning(
+                "Could not add %d hydroxyl groups as there are no more carbon atoms to oxidize",
+                n_OH - n_added,
+            )
+            break
+        n_batch = n_OH - n_added
+        if size_policy == "stop":
+            # Stop at the first group which takes the structure over budget, as when adding them one at a time
+            n_batch = min(n_batch, max(0, max_atoms - len(graphene)) // 2 + 1)
+        carbon_atoms, sides = carbon_atoms[:n_batch], sides[:n_batch]
+        n_batch = len(carbon_atoms)
+        stats.count("hydroxyl_attempts", n_batch)
+
+        # Oxygen atom 1.49 Angstroms above or below the buckled carbon atom
+        buckling = sides * rng.choice(buckling_OH, size=n_batch)
+        carbon_pos = graphene.positions[carbon_atoms]
+        carbon_pos[:, 1] += buckling
+        oxygen_pos = carbon_pos.copy()
+        oxygen_pos[:, 1] += sides * 1.49
+
+        # Hydrogen atom with a bond angle of 100-115 degrees and bond length of 0.98 Angstroms, randomly oriented
+        theta_deg = 100.0 + rng.random(n_batch) * 15.0
+        theta = np.deg2rad(np.where(sides > 0, 180 - theta_deg, theta_deg))
+        phi = np.deg2rad(rng.random(n_batch) * 360.0)
+        H_pos = oxygen_pos + 0.98 * np.stack(
+            [np.sin(theta) * np.cos(phi), np.cos(theta), np.sin(theta) * np.sin(phi)],
+            axis=1,
+        )
+
+        group_positions = np.stack([oxygen_pos, H_pos], axis=1)
+        valid = ~find_clashing_groups(graphene, index, group_positions, [8, 1])
+        # Counts are cast to int, as they end up in the (JSON) record of the build
+        n_valid = int(np.count_nonzero(valid))
+        stats.count("collision_checks", n_batch)
+        stats.count("hydroxyl_rejections", n_batch - n_valid)
+
+        # Only the valid groups are added, the carbon atoms of the rejected ones stay available
+        graphene.positions[carbon_atoms[valid]] = carbon_pos[valid]
+        new_atoms = graphene.extend(
+            np.tile([8, 1], n_valid),
+            group_positions[valid].reshape(-1, 3),
+        )
+        for atom in carbon_atoms[valid].tolist():
+            available.remove(atom)
+        for atom, position in zip(
+            new_atoms.tolist(), group_positions[valid].reshape(-1, 3)
+        ):
+            index.add(atom, position)
+
+        n_added += n_valid
+        progress.update(n_added)
+        if len(graphene) > max_atoms and not size_checked:
+            # The size policy is only applied once per structure
+            size_checked = True
+            if apply_size_policy(size_policy, max_atoms):
+                break
+    progress.finish(n_added)
+    return graphene, available, n_added
+
+
+def pick_random_carbon(graphene, available, nn_graph, max_iterations, rng, stats=None):
+    """_summary_
+    Pick a random carbon atom with an available neighbour for a hydroxyl group (the carbon atom is only
+    removed from the available ones once the group has been added)
+
+    Parameters
+    ----------
+    graphene : buffer.AtomBuffer
+        Graphene structure (staged atoms)
+    available : utilities.RandomSet
+        Indices of the carbon atoms which have not been oxidised yet
+    nn_graph : neighbours.NeighbourGraph
+        Graph of nearest neighbours
+    max_iterations : int
+        Maximum number of carbon atoms to try
+    rng : numpy.random.Generator
+        Random number generator
+    stats : profiling.Stats, optional
+        Counters of the build, updated with the carbon atoms retried and max iteration exits
+    """
+    if stats is None:
+        stats = profiling.Stats()
     # Set the maximum number of iterations
     iterations = 0
     while iterations < max_iterations:
-        # Create a list of all possible carbon atoms to choose from
-        choices = list(range(N_atoms))
-        # Remove the oxidised carbon atoms from the list of choices
-        choices = [c for c in choices if c not in oxidised_atoms]
-        # If choices is empty, then we have oxidised all the carbon atoms and we need to exit the function
-        if epoxy:
-            a = "epoxy"
-        else:
-            a = "hydroxyl"
-        if len(choices) == []:
-            print(f"All carbon atoms have been oxidised for {a}")
-            return graphene, oxidised_atoms, None, None, iterations
+        # If there are no carbon atoms left, then we have oxidised all the carbon atoms and we need to exit the function
+        if len(available) == 0:
+            logger.info("All carbon atoms have been oxidised for hydroxyl")
+            return graphene, available, None, None, iterations
         else:
-            # Choose a random carbon atom
-            carbon_atom = np.random.choice(choices)
-            # Choose a random neighbour
-            neighbours_store = nn_list[np.where(nn_list[:, 0] == carbon_atom)]
+            # Choose a random carbon atom which has not been oxidised
+            carbon_atom = available.choice(rng)
             # Remove the oxidised atoms from the list of neighbours
-            neighbours = [n for n in neighbours_store[:, -1] if n not in oxidised_atoms]
+            neighbours = [
+                n for n in nn_graph.first_shell(carbon_atom) if n in available
+            ]
             # If there are no neighbours, then we need to pick a new carbon atom
             if len(neighbours) == 0:
-                print(
-                    f"Iteration {iterations}: No neighbours found, picking new carbon atom"
+                logger.debug(
+                    "Iteration %d: No neighbours found, picking new carbon atom",
+                    iterations,
                 )
                 iterations += 1
-                # return graphene, oxidised_atoms, None, None
+                stats.count("carbon_retries")
             else:
-                neighbour = np.random.choice(neighbours)
-
-                # Append oxidised carbon atom positions so we dont try and epoxy/hydroxyl group them again
-                # oxidised_atoms.append(carbon_atom)
-
-                if epoxy:
-                    oxidised_atoms.append(carbon_atom)
-                    oxidised_atoms.append(neighbour)  # append only oxidized atom
+                neighbour = rng.choice(neighbours)
 
-                # for OH, oxidised atoms are separately added to the list
-                # after checking conditions of least distance for both O and H,
-                # append C to oxidised atoms list.
+                # Oxidised atoms are removed from the available atoms by the caller, after checking
+                # conditions of least distance for both O and H.
 
                 return (
                     graphene,
-                    oxidised_atoms,
+                    available,
                     carbon_atom,
                     neighbour,
                     iterations,
                 )
-    print(
-        f"WARNING: Maximum iterations reached for {a}. Check your structure to ensure it is correct"
+    stats.count("max_iteration_exits")
+    logger.warning(
+        "Maximum iterations reached for hydroxyl. Check your structure to ensure it is correct"
     )
-    return graphene, oxidised_atoms, None, None, iterations
+    return graphene, available, None, None, iterations
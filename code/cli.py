@@ -0,0 +1,358 @@
+"""_summary_
+Command line entry point of the graphene oxide builder. A sweep over the structural parameters (p1-p4) is
+described by a config file (YAML or JSON) instead of being edited into a run script, e.g.
+
+    python cli.py sweep configs/sheet.yaml
+    python cli.py sweep configs/amorphous.yaml --dry-run
+
+See the files in configs/ for the available settings.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import time
+
+import numpy as np
+import profiling
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+STRUCTURES = ("sheet", "ribbon", "amorphous")
+
+# Settings of a sweep config and their default values (None if they are required)
+DEFAULTS = {
+    "structure": "sheet",
+    "size": [7, 5],
+    "vacuum": 10,
+    "database": None,
+    "edges": None,
+    "grid": None,
+    "functional_groups": ["carboxyl", "aldehyde", "hydroxyl"],
+    "output": None,
+    "sink": None,
+    "profile": None,
+    "repeats": 1,
+    "workers": None,
+    "seed": None,
+    "max_iterations": 200,
+    "size_policy": "warn",
+    "max_atoms": 300,
+    "placement": "sequential",
+    "quiet": True,
+    "start_method": None,
+}
+
+
+def load_config(path):
+    """
+    Summary
+    ----------
+    Read a sweep config and fill in the default values of the settings it does not give
+
+    Parameters
+    ----------
+    path : str
+        Path to the config, a JSON file (.json) or a YAML file (any other extension)
+    """
+    with open(path) as f:
+        if path.endswith(".json"):
+            config = json.load(f)
+        elif yaml is None:
+            raise ImportError(
+                f"PyYAML is needed to read {path}, install it or use a JSON config"
+            )
+        else:
+            config = yaml.safe_load(f)
+
+    unknown = set(config) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(
+            f"Unknown settings {sorted(unknown)} in {path}, expected some of {list(DEFAULTS)}"
+        )
+    config = {**DEFAULTS, **config}
+
+    if config["structure"] not in STRUCTURES:
+        raise ValueError(
+            f"Unknown structure {config['structure']!r}, expected one of {STRUCTURES}"
+        )
+    if config["structure"] == "amorphous" and config["database"] is None:
+        raise ValueError("An amorphous sweep needs the path of the database")
+    # Ribbons always have functionalised edges, amorphous structures only if they are cleaved (edges: true)
+    if config["edges"] is None:
+        config["edges"] = config["structure"] == "ribbon"
+    elif config["structure"] != "amorphous":
+        raise ValueError(
+            f"The edges setting is only used for amorphous structures, not {config['structure']!r}"
+        )
+    elif not isinstance(config["edges"], bool):
+        raise ValueError(
+            f"The edges setting must be true or false, not {config['edges']!r}"
+        )
+    for name in ("grid", "output"):
+        if config[name] is None:
+            raise ValueError(f"Missing setting {name!r} in {path}")
+
+    # Paths are relative to the config, so a sweep can be launched from any directory (in a stream, the
+    # output template is only the id of each structure and is kept as is)
+    directory = os.path.dirname(os.path.abspath(path))
+    paths = (
+        ("database", "sink", "profile")
+        if config["sink"]
+        else ("database", "output", "profile")
+    )
+    for name in paths:
+        if config[name] is not None:
+            config[name] = os.path.normpath(os.path.join(directory, config[name]))
+    return config
+
+
+def expand_values(values):
+    """
+    Summary
+    ----------
+    Expand the values of a parameter of the grid: a single value, a list of values, or a range given as
+    {start, stop, step} (stop excluded, as numpy.arange) or {start, stop, num} (stop included, as
+    numpy.linspace), in which case the values can be spaced as a power with {power}
+
+    Parameters
+    ----------
+    values : float, list or dict
+        Values of the parameter
+    """
+    if isinstance(values, dict):
+        if "step" in values:
+            return np.arange(values["start"], values["stop"], values["step"]).tolist()
+        # Values evenly spaced as value**(1/power) (power = 1 is a plain linspace)
+        power = float(values.get("power", 1))
+        start, stop = values["start"] ** (1 / power), values["stop"] ** (1 / power)
+        return (np.linspace(start, stop, values["num"]) ** power).tolist()
+    if isinstance(values, (list, tuple)):
+        return list(values)
+    return [values]
+
+
+def make_grid(config):
+    """
+    Summary
+    ----------
+    Build the grid of parameters of the sweep; p6 is only varied for amorphous structures and p4 for
+    structures with edges
+
+    Parameters
+    ----------
+    config : dict
+        Sweep config
+    """
+    grid = {name: expand_values(v) for name, v in config["grid"].items()}
+    unknown = set(grid) - {"O_content", "OH_ratio", "p6", "p4"}
+    if unknown:
+        raise ValueError(f"Unknown parameters {sorted(unknown)} in the grid")
+    if config["structure"] != "amorphous":
+        grid["p6"] = [1]
+    if not config["edges"]:
+        grid["p4"] = [0]
+    for name in ("O_content", "OH_ratio"):
+        if name not in grid:
+            raise ValueError(f"Missing parameter {name!r} in the grid")
+    return grid
+
+
+def make_structure(config):
+    """
+    Summary
+    ----------
+    Build the initial structure of the sweep (or open the amorphous database)
+
+    Parameters
+    ----------
+    config : dict
+        Sweep config
+    """
+    if config["structure"] == "amorphous":
+        from database import AmorphousDatabase
+
+        # Frames are only read when they are selected, so the workers do not hold the whole database in memory
+        return AmorphousDatabase(config["database"])
+
+    from ase.build import graphene_nanoribbon
+
+    # Saturated 1D ribbon with edges, or pristine 2D graphene
+    ribbon = config["structure"] == "ribbon"
+    n, m = config["size"]
+    return graphene_nanoribbon(
+        n,
+        m,
+        type="armchair",
+        saturated=ribbon,
+        sheet=not ribbon,
+        vacuum=config["vacuum"],
+    )
+
+
+def sweep_args(config):
+    """
+    Summary
+    ----------
+    Arguments of sweep.run_sweep for a config
+
+    Parameters
+    ----------
+    config : dict
+        Sweep config
+    """
+    import groups
+
+    return dict(
+        graphene=make_structure(config),
+        grid=make_grid(config),
+        disorder=config["structure"] == "amorphous",
+        edges=config["edges"],
+        funct_groups=groups.get(*config["functional_groups"], site="edge"),
+        vacuum=config["vacuum"],
+        max_iterations=config["max_iterations"],
+        output=config["output"],
+        repeats=config["repeats"],
+        workers=config["workers"],
+        seed=config["seed"],
+        size_policy=config["size_policy"],
+        max_atoms=config["max_atoms"],
+        placement=config["placement"],
+        profile=config["profile"],
+        quiet=config["quiet"],
+        sink=config["sink"],
+        start_method=config["start_method"],
+    )
+
+
+def estimate(args, calibrate=True):
+    """
+    Summary
+    ----------
+    Count the jobs of a sweep (and the ones left to run) and estimate its cost, from the mean time of the
+    structures in the profile of a previous run if there is one, otherwise by timing the build of a single
+    structure in memory (nothing is written)
+
+    Parameters
+    ----------
+    args : dict
+        Arguments of sweep.run_sweep
+    calibrate : bool, optional
+        If False, no structure is built and only the jobs are counted, by default True
+    """
+    import sweep
+    from sink import MemorySink, read_jobs
+
+    # Without a seed the jobs are the same, only their seeds differ
+    jobs = sweep.parameter_grid(
+        args["grid"], args["output"], args["repeats"], args["seed"]
+    )
+    if args["sink"] is not None:
+        done = read_jobs(args["sink"])[0]
+        todo = [job for job in jobs if job["output_structure"] not in done]
+    else:
+        todo = [job for job in jobs if not os.path.exists(job["output_structure"])]
+
+    workers = args["workers"] or os.cpu_count()
+    summary = {
+        "jobs": len(jobs),
+        "todo": len(todo),
+        "workers": workers,
+        "seconds_per_job": None,
+    }
+
+    if args["profile"] is not None and os.path.exists(args["profile"]):
+        with open(args["profile"]) as f:
+            records = json.load(f)["records"]
+        if records:
+            summary["seconds_per_job"] = float(
+                np.mean([r["job_time"] for r in records])
+            )
+            summary["calibration"] = f"profile of {len(records)} structures"
+    if summary["seconds_per_job"] is None and calibrate and todo:
+        job = todo[0]
+        output = MemorySink()
+        # The build logs are not wanted in the summary
+        logging.disable(logging.WARNING)
+        start = time.perf_counter()
+        sweep.build_job(job, args, output)
+        summary["seconds_per_job"] = time.perf_counter() - start
+        logging.disable(logging.NOTSET)
+        summary["calibration"] = f"build of {job['output_structure']}"
+        summary["n_atoms"] = len(output.structures[0])
+
+    if summary["seconds_per_job"] is not None:
+        summary["cpu_seconds"] = summary["seconds_per_job"] * len(todo)
+        summary["wall_seconds"] = summary["seconds_per_job"] * math.ceil(
+            len(todo) / workers
+        )
+    return summary
+
+
+def sweep_command(options):
+    config = load_config(options.config)
+    for name in ("workers", "seed"):
+        if getattr(options, name) is not None:
+            config[name] = getattr(options, name)
+    args = sweep_args(config)
+
+    if options.dry_run:
+        summary = estimate(args, calibrate=not options.no_calibrate)
+        print(f"Jobs: {summary['jobs']} ({summary['todo']} left to run)")
+        if summary["seconds_per_job"] is not None:
+            print(
+                f"Estimated cost: {summary['seconds_per_job']:.2f} s per structure "
+                f"({summary['calibration']}), {summary['cpu_seconds']:.1f} CPU seconds, "
+                f"{summary['wall_seconds']:.1f} s on {summary['workers']} workers"
+            )
+        return 0
+
+    import sweep
+
+    sweep.run_sweep(**args)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="also log the rejected placements"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_sweep = commands.add_parser(
+        "sweep", help="generate the structures of a parameter sweep"
+    )
+    parser_sweep.add_argument("config", help="sweep config (YAML or JSON)")
+    parser_sweep.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the number of jobs and the estimated cost without running them",
+    )
+    parser_sweep.add_argument(
+        "--no-calibrate",
+        action="store_true",
+        help="with --dry-run, do not build a structure to estimate the cost",
+    )
+    parser_sweep.add_argument(
+        "--workers", type=int, help="number of worker processes (overrides the config)"
+    )
+    parser_sweep.add_argument(
+        "--seed", type=int, help="seed of the sweep (overrides the config)"
+    )
+    parser_sweep.set_defaults(func=sweep_command)
+
+    options = parser.parse_args(argv)
+    profiling.configure_logging(logging.DEBUG if options.verbose else logging.INFO)
+    return options.func(options)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,292 @@
+import hashlib
+import io
+import logging
+import os
+from functools import cached_property
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ase.io is slow to import (it pulls in scipy), it is only imported when frames are parsed so that opening a
+# database with a saved index stays cheap
+
+
+def index_frames(path):
+    """
+    Summary
+    ----------
+    Scan a multi-frame xyz file and get the byte offset of each frame along with its comment line,
+    without parsing the atoms. A partially written last frame (e.g. after a crash) is left out.
+
+    Parameters
+    ----------
+    path : str
+        Path to the xyz file
+
+    Returns
+    -------
+    offsets : numpy.ndarray
+        Byte offset of the start of each frame, followed by the offset of the end of the last complete frame
+    comments : list
+        Comment (second) line of each frame
+    """
+    offsets = []
+    comments = []
+    with open(path, "rb") as f:
+        end = 0
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                break
+            if not line.strip():
+                end = f.tell()
+                continue
+            n_atoms = int(line)
+            comment = f.readline()
+            # Every line of a complete frame ends with a newline
+            if not comment.endswith(b"\n") or not all(
+                f.readline().endswith(b"\n") for _ in range(n_atoms)
+            ):
+                break
+            offsets.append(offset)
+            comments.append(comment.decode().strip())
+            end = f.tell()
+        offsets.append(end)
+    return np.array(offsets, dtype=np.int64), comments
+
+
+class P6Index:
+    """
+    Summary
+    ----------
+    Sorted index of the p6 values of a database, which finds the structures within a p6 window with a
+    binary search. The p6 range is split into the same bins as a histogram of the p6 values.
+
+    Parameters
+    ----------
+    p6 : numpy.ndarray
+        p6 value of each structure
+    bins : int
+        Number of bins the p6 range is split into
+    """
+
+    def __init__(self, p6, bins=100):
+        p6 = np.asarray(p6, dtype=float)
+        self.order = np.argsort(p6, kind="stable")
+        self.sorted_p6 = p6[self.order]
+        self.bin_edges = np.histogram_bin_edges(p6, bins=bins)
+        self.bin_centers = (self.bin_edges[:-1] + self.bin_edges[1:]) / 2
+
+    def window(self, low, high):
+        """
+        Summary
+        ----------
+        Get the indices of the structures with low <= p6 < high
+
+        Parameters
+        ----------
+        low : float
+            Lower bound of the window
+        high : float
+            Upper bound of the window (excluded)
+        """
+        start, stop = np.searchsorted(self.sorted_p6, [low, high], side="left")
+        # Indices are returned in database order, so a given random draw picks the same structure
+        # whichever way the window was found
+        return np.sort(self.order[start:stop])
+
+    def closest_bin(self, p6):
+        """
+        Summary
+        ----------
+        Get the indices of the structures in the bin with the centre closest to a p6 value
+
+        Parameters
+        ----------
+        p6 : float
+            Desired p6 value
+        """
+        bin_index = np.argmin(abs(self.bin_centers - p6))
+        return self.window(self.bin_edges[bin_index], self.bin_edges[bin_index + 1])
+
+    def sample(self, p6, rng, size=None, replace=True):
+        """
+        Summary
+        ----------
+        Draw random structures from the bin closest to a p6 value
+
+        Parameters
+        ----------
+        p6 : float
+            Desired p6 value
+        rng : numpy.random.Generator
+            Random number generator
+        size : int, optional
+            Number of structures to draw, by default a single index is returned
+        replace : bool, optional
+            Whether the same structure can be drawn more than once, by default True
+        """
+        structures_in_bin = self.closest_bin(p6)
+        # If there are no structures in the selected bin we raise an exception
+        if len(structures_in_bin) == 0:
+            raise ValueError("No structures found in the selected bin.")
+        if size is None:
+            return structures_in_bin[rng.integers(len(structures_in_bin))]
+        if not replace and size > len(structures_in_bin):
+            raise ValueError(
+                f"Only {len(structures_in_bin)} structures found in the selected bin, {size} requested."
+            )
+        return rng.choice(structures_in_bin, size=size, replace=replace)
+
+
+class StructureList(list):
+    """
+    Summary
+    ----------
+    Database of amorphous graphene structures held in memory (e.g. all the frames read from an xyz file),
+    which keeps its p6 index between selections as AmorphousDatabase does
+
+    Parameters
+    ----------
+    structures : list
+        Structures of the database, each with its p6 value in its info
+    """
+
+    @cached_property
+    def p6_index(self):
+        # Built once and reused for every selection from the database
+        return P6Index([atoms.info["p6"] for atoms in self])
+
+
+def as_database(structures):
+    """
+    Summary
+    ----------
+    Get a database which keeps its p6 index from a list of structures (databases are returned as they are)
+
+    Parameters
+    ----------
+    structures : list, StructureList or AmorphousDatabase
+        Database of amorphous graphene structures
+    """
+    if hasattr(structures, "p6_index"):
+        return structures
+    return StructureList(structures)
+
+
+def cache_index_path(path):
+    """
+    Summary
+    ----------
+    Path of the index of a database in the user cache directory ($XDG_CACHE_HOME, by default ~/.cache),
+    named after the absolute path of the database
+
+    Parameters
+    ----------
+    path : str
+        Path to the xyz file
+    """
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+    return os.path.join(cache, "go-mace", f"{os.path.basename(path)}-{key}.idx.npz")
+
+
+class AmorphousDatabase:
+    """
+    Summary
+    ----------
+    Indexed, lazily loaded database of amorphous graphene structures stored in a multi-frame extxyz file.
+    The byte offset and p6 value of every frame are stored in a sidecar index file (built on first use),
+    and only the frames that are selected are read and parsed.
+
+    Parameters
+    ----------
+    path : str
+        Path to the xyz file
+    index_path : str, optional
+        Path to the sidecar index, by default the path of the xyz file with ".idx.npz" appended, or a file in
+        the user cache directory if the database is on read-only storage
+    """
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        if index_path is not None:
+            self.index_paths = [index_path]
+        else:
+            self.index_paths = [path + ".idx.npz", cache_index_path(path)]
+        # Path the index was loaded from or saved to (None if it is only kept in memory)
+        self.index_path = None
+        self.offsets, self.p6 = self._load_index()
+
+    def _load_index(self):
+        # The index is rebuilt if the database has changed since it was written
+        stat = os.stat(self.path)
+        for index_path in self.index_paths:
+            if not os.path.exists(index_path):
+                continue
+            with np.load(index_path) as index:
+                if index["size"] == stat.st_size and index["mtime"] == stat.st_mtime_ns:
+                    self.index_path = index_path
+                    return index["offsets"], index["p6"]
+
+        from ase.io.extxyz import key_val_str_to_dict
+
+        offsets, comments = index_frames(self.path)
+        p6 = np.array([key_val_str_to_dict(c)["p6"] for c in comments], dtype=float)
+
+        # The index is saved to the first writable location; if there is none (e.g. read-only shared storage
+        # and no cache directory) it is only kept in memory and rebuilt the next time
+        for index_path in self.index_paths:
+            # Write to a temporary file first, so that concurrent readers never see a partial index
+            tmp_path = f"{index_path}.{os.getpid()}.tmp.npz"
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+                np.savez(
+                    tmp_path,
+                    offsets=offsets,
+                    p6=p6,
+                    size=stat.st_size,
+                    mtime=stat.st_mtime_ns,
+                )
+                os.replace(tmp_path, index_path)
+            except OSError as error:
+                logger.debug("Could not save the index to %s: %s", index_path, error)
+                continue
+            self.index_path = index_path
+            return offsets, p6
+
+        logger.warning(
+            "Could not save the index of %s, it is kept in memory only", self.path
+        )
+        return offsets, p6
+
+    def __len__(self):
+        return len(self.p6)
+
+    @cached_property
+    def p6_index(self):
+        # Built once and reused for every selection from the database
+        return P6Index(self.p6)
+
+    def __getitem__(self, i):
+        """
+        Summary
+        ----------
+        Read a single frame of the database
+
+        Parameters
+        ----------
+        i : int
+            Index of the frame
+        """
+        i = range(len(self))[i]
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[i])
+            frame = f.read(self.offsets[i + 1] - self.offsets[i])
+        from ase.io import read
+
+        return read(io.StringIO(frame.decode()), format="extxyz")
@@ -1,9 +1,14 @@
-import random
+import logging
 from math import cos, pi
 
+import buffer
+import groups
 import numpy as np
+import profiling
+import spatial
 import utilities
-from ase import neighborlist
+
+logger = logging.getLogger(__name__)
 
 
 def add_edge_functionality(
@@ -14,10 +19,11 @@ def add_edge_functionality(
     distance,
     N_groups,
     funct_atoms,
-    neighbor_list,
-    box_size,
     max_iter,
+    rng,
     C_H_bond_length=1.09,
+    stats=None,
+    collision_radius=2.55,
 ):
     # add error handling for iter > max_iter
 
@@ -30,106 +36,127 @@ def add_edge_functionality(
     ----------
     graphene : ase.Atoms
         Graphene structure
-    edge_atoms : list
-        List with indices of all edge atoms
+    edge_atoms : numpy.ndarray
+        Boolean mask of the edge atoms
     h_atoms : list
         Indices of h atoms in graphene structure
-    funct_groups : ase.Atoms list
-        List of atoms object containing possible functinal groups to be added
+    funct_groups : list
+        Possible functional groups to be added, as groups.GroupTemplate (or ase.Atoms) objects
     distance: float
         Bond distance between group and carbon edge
     N_groups : int
         Number of functional groups to be added to surface
-    funct_atoms: list
-        List containing all previously oxidised H atoms
-    neighbor_list: list
-        List containing the atoms in the collision zone of each atom
-    box_size: float
-        vacuum between ribbons
-    C_H_bond_length: float
-        C-H bond length in (default = 1.09 A)
+    funct_atoms: numpy.ndarray
+        Boolean mask of the H atoms which have been functionalised
     max_iter: int
         Max number of iterations for rotating bond
+    rng : numpy.random.Generator
+        Random number generator
+    C_H_bond_length: float
+        C-H bond length in (default = 1.09 A)
+    stats : profiling.Stats, optional
+        Counters of the build, updated with the attempts, rejections and collision checks
+    collision_radius : float, optional
+        Radius around the removed H atom in which the H and group atoms make up its collision zone
+        (default = 2.55 A)
     """
+    # Groups are placed from their frozen templates, so no Atoms object is built per placement
+    funct_groups = [groups.as_template(group) for group in funct_groups]
+    groups.check_site(funct_groups, "edge")
+
+    if stats is None:
+        stats = profiling.Stats()
+    progress = profiling.Progress(logger, "edge groups", N_groups)
 
-    # Copy of neighbor list - prevetns overwritting
-    neighbors_cp = neighbor_list.copy()
+    # Spatial index of the edge H atoms and of the atoms of the added groups, which make up the
+    # collision zone of each H atom to be replaced
+    index = spatial.CellList.from_atoms(graphene, h_atoms, collision_radius)
 
-    # Save original number of c atoms to access indices of added atoms after functionalisation
-    sheet_atoms = len(graphene[graphene.numbers == 6])
+    # H atoms which can still be replaced
+    candidates = utilities.RandomSet(h_atoms)
+
+    # Atoms are staged in a buffer while the groups are added
+    graphene = buffer.AtomBuffer(graphene)
 
     # We create a variable to keep tack of the amount of groups we have added
     N_added = 0
 
     # Select random hydrogens and replace them with functional groups
     for i in range(N_groups):
-        # Create copy of group to prevent overwriting
-        group = funct_groups[random.randint(0, len(funct_groups) - 1)].copy()
+        group = funct_groups[rng.integers(len(funct_groups))]
 
-        h, funct_atoms = pick_random_h(graphene, h_atoms, funct_atoms)
+        h, funct_atoms = pick_random_h(graphene, candidates, funct_atoms, rng)
+        if h is None:
+            break
 
         # Save position of removed h
-        h_pos = np.array(graphene[h].position)
+        h_pos = graphene.positions[h].copy()
 
-        # Orient group away from ribbon
-        if h_pos[0] <= box_size / 2:
+        # Orient group away from ribbon, which is centred along the first lattice vector
+        # (fractional coordinate, so that it also holds for skewed cells)
+        if graphene.get_cell().scaled_positions(h_pos[None])[0, 0] <= 0.5:
             orientation = -1
         else:
             orientation = 1
-        group_pos_init = group.get_positions()
-        group_pos_init *= orientation
-
-        # Move functional group along x direction to ensure realistic bond lenght. Approx 120 degree bond angle is used for calculation
-        h_pos[0] += orientation * cos((1 / 6) * pi) * (distance - C_H_bond_length)
-        # Assign random initial orientation to functional group
-        angle = random.uniform(0, 180)
-        # Create functional group in initial position
-        group = position_group(group, group_pos_init, angle, h_pos)
+        group_pos_init = group.oriented(orientation)
 
         # Get the collision zone of the H atom to be removed
-        collision_zone = neighbors_cp[:, 1][neighbors_cp[:, 0] == h]
+        collision_zone = index.query(h_pos, collision_radius)
+        collision_zone = collision_zone[collision_zone != h]
 
-        valid_group = utilities.is_structure_valid(graphene, group, collision_zone)
-        iter = 0
-        # If group is not valid (close contacts present) then rotate it until its position is valid (oly up to max iteration times)
-
-        while not valid_group and iter < max_iter:
-            angle += random.uniform(5, 10)
-            group = position_group(group, group_pos_init, angle, h_pos)
-            iter += 1
-            valid_group = utilities.is_structure_valid(graphene, group, collision_zone)
+        # Move functional group along x direction to ensure realistic bond lenght. Approx 120 degree bond angle is used for calculation
+        h_pos[0] += orientation * cos((1 / 6) * pi) * (distance - C_H_bond_length)
+        # Assign random initial orientation to functional group, if the group is not valid (close contacts present)
+        # then it is rotated until its position is valid (only up to max iteration times)
+        angles = rng.uniform(0, 180) + np.concatenate(
+            [[0], np.cumsum(rng.uniform(5, 10, max_iter))]
+        )
+        # Create functional group at all the orientations at once
+        placements = position_group(group_pos_init, angles, h_pos)
+
+        # Check all the orientations in one go and keep the first valid one
+        valid = utilities.valid_placements(
+            graphene, placements, group.numbers, collision_zone
+        )
+        valid_group = valid.any()
+        stats.count("edge_attempts")
+        stats.count("collision_checks", len(placements))
 
         # Add valid functional group to graphene sheet
         if valid_group:
             N_added += 1
-            print(f"Added {N_added} edge group ({100*N_added/N_groups:.2f}%)")
-            graphene.extend(group)
-
-            for i in collision_zone:
-                if i in neighbors_cp:
-                    for j in range(1, len(group) + 1):
-                        neighbors_cp = np.concatenate(
-                            (neighbors_cp, [[i, len(graphene) - j]]), axis=0
-                        )
-
-            neighbors_cp = neighbors_cp[neighbors_cp[:, 0] != h]
-            neighbors_cp = neighbors_cp[neighbors_cp[:, 1] != h]
+            progress.update(N_added)
+            placement = placements[np.argmax(valid)]
+            new_atoms = graphene.extend(group.numbers, placement)
+
+            # The removed H atom leaves the collision zones, and the group atoms join them
+            index.remove(h)
+            for atom, position in zip(new_atoms.tolist(), placement):
+                index.add(atom, position)
         else:
-            print("Could not add functional group to this position")
-            # Remove added H from functionalised atonms
-            funct_atoms = funct_atoms[funct_atoms != h]
+            stats.count("edge_rejections")
+            logger.debug("Could not add functional group to this position")
+            # Remove added H from functionalised atonms, it can be picked again
+            funct_atoms[h] = False
+            candidates.add(h)
+
+    progress.finish(N_added)
+    graphene = graphene.to_atoms()
+
+    # Save all new groups to edge atoms (they are appended after the original atoms)
+    edge_atoms = np.concatenate(
+        [edge_atoms, np.ones(len(graphene) - len(edge_atoms), dtype=bool)]
+    )
 
     # Remove all unecessary H atoms
-    del graphene[funct_atoms.astype(int)]
-
-    # Save all new groups to edge atoms (All edge atoms have indices larger than the last carbon in the original sheet)
-    for i in range(sheet_atoms, len(graphene)):
-        edge_atoms.append(i)
+    removed = np.flatnonzero(funct_atoms)
+    del graphene[removed]
+    edge_atoms = np.delete(edge_atoms, removed)
 
     return graphene, edge_atoms, N_added
 
 
-def pick_random_h(graphene, h_atoms, funct_atoms):
+def pick_random_h(graphene, h_atoms, funct_atoms, rng):
     """
     Summary
     ----------
@@ -137,68 +164,87 @@ def pick_random_h(graphene, h_atoms, funct_atoms):
 
     Parameters
     ----------
-    graphene : ase.Atoms
+    graphene : buffer.AtomBuffer
         Graphene structure
-    h_atoms : list
-        Indices of h atoms in graphene structure
-    funct_atoms : list
-        List of the indices of the edge hydrogen atoms which have been functionalised
+    h_atoms : utilities.RandomSet
+        Indices of the h atoms which have not been functionalised yet
+    funct_atoms : numpy.ndarray
+        Boolean mask of the edge hydrogen atoms which have been functionalised
+    rng : numpy.random.Generator
+        Random number generator
     """
 
-    # Create array of possible h atoms which can be oxidised
-    choices = [h for h in h_atoms if h not in funct_atoms]
-
-    # If choices is empty, then we have oxidised all the carbon atoms and we need to exit the function
-    if len(choices) == 0:
-        print(f"All edge hydrogen atoms have been oxidised")
+    # If there are no H atoms left, then we have oxidised all the edge atoms and we need to exit the function
+    if len(h_atoms) == 0:
+        logger.info("All edge hydrogen atoms have been oxidised")
         return None, funct_atoms
     else:
         # Choose a random H atom
-        h_atom = np.random.choice(choices)
-        # Append substituted H atom positions so we dont try and substitute them again
-        funct_atoms = np.append(funct_atoms, h_atom)
+        h_atom = h_atoms.choice(rng)
+        # Mark the substituted H atom so we dont try and substitute it again
+        h_atoms.remove(h_atom)
+        funct_atoms[h_atom] = True
 
     return h_atom, funct_atoms
 
 
-def position_group(group, pos_init, angle, h_pos):
+def position_group(pos_init, angles, h_pos):
     """
     Summary
     ----------
-    Add rotated functional group to ribbon
+    Positions of the functional group attached to the ribbon, rotated by each of the given angles
 
     Parameters
     ----------
-    group: ase.Atoms
-        Functional group added to nanoriibon
-    pos_init : Positions of group if origin was (0,0,0)
-        Indices of atoms that can collide with functional group
-    angle:
-        Angle by which to rotate group
+    pos_init : numpy.ndarray
+        Positions of group if origin was (0,0,0)
+    angles: numpy.ndarray
+        Angles (in degrees) by which to rotate group around the x axis
     h_pos:
         Position of removed H atom
-    """
-    # Generate group centered at (0,0,0) with a random orientation
-    group.set_positions(pos_init)
-    group.rotate(angle, "x")
 
-    # Connect group to graphene network
-    group_pos = group.get_positions()
-    group_pos += np.broadcast_to(h_pos, (len(group), 3))
-    group.set_positions(group_pos)
+    Returns
+    -------
+    numpy.ndarray
+        Positions of the group for each angle, shape (N_angles, N_group, 3)
+    """
+    # Stack of rotation matrices around the x axis (same convention as ase.Atoms.rotate)
+    theta = np.deg2rad(np.asarray(angles, dtype=float))
+    c, s = np.cos(theta), np.sin(theta)
+    rotations = np.zeros((len(theta), 3, 3))
+    rotations[:, 0, 0] = 1
+    rotations[:, 1, 1] = c
+    rotations[:, 1, 2] = -s
+    rotations[:, 2, 1] = s
+    rotations[:, 2, 2] = c
 
-    return group
+    # Rotate group centered at (0,0,0) and connect it to graphene network
+    return np.einsum("aij,kj->aki", rotations, pos_init) + h_pos
 
 
 def get_edge_carbons(graphene):
-    # Build C-H NeighborList object
+    """
+    Summary
+    ----------
+    Find the edge carbon atoms, i.e. the carbon atoms bonded to a hydrogen atom
+
+    Parameters
+    ----------
+    graphene : ase.Atoms
+        Graphene structure
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask of the edge carbon atoms
+    """
+    # Build C-H NeighborList object (imported here, see neighbours.NeighbourGraph.from_atoms)
+    from ase import neighborlist
+
     i, j = neighborlist.neighbor_list(
         "i" "j", graphene, cutoff=1.15, self_interaction=False
     )
-    nn_list = np.array((i, j)).T
-    edge_atoms = []
-    for pair in nn_list:
-        if graphene[pair[0]].symbol == "H":
-            # We add bot the edge C to the oxidised carbon list to avoid oxidising them again later
-            edge_atoms.append(pair[1])
+    # We add both the edge C to the oxidised carbon list to avoid oxidising them again later
+    edge_atoms = np.zeros(len(graphene), dtype=bool)
+    edge_atoms[j[(graphene.numbers[i] == 1) & (graphene.numbers[j] == 6)]] = True
     return edge_atoms
@@ -6,14 +6,21 @@ This script generates a decorated graphene oxide structure from pristine graphen
 
 """
 
+import logging
 import time
 
-import amorphous
 import bulk_oxidation
-import edge_oxidation
+import buffer
+import neighbours
 import numpy as np
-from ase import neighborlist
-from ase.io import write
+import profiling
+import spatial
+import utilities
+
+# amorphous, edge_oxidation and ase.io are only imported by the builds which need them, so that starting a
+# worker (or a script) does not pay for modules it never uses
+
+logger = logging.getLogger(__name__)
 
 
 class build:
@@ -37,11 +44,36 @@ class build:
         vacuum,
         max_iterations,
         output_structure,
+        size_policy="warn",
+        max_atoms=300,
+        seed=None,
+        placement="sequential",
     ):
         start_time = time.time()
 
+        # All the random choices of the build are drawn from a single generator, so a structure can be
+        # regenerated exactly from its seed (which is saved with the structure)
+        if seed is None:
+            seed = utilities.random_seed()
+        rng = np.random.default_rng(seed)
+
+        if size_policy not in bulk_oxidation.SIZE_POLICIES:
+            raise ValueError(
+                f"Unknown size policy {size_policy!r}, expected one of {bulk_oxidation.SIZE_POLICIES}"
+            )
+        if placement not in bulk_oxidation.PLACEMENTS:
+            raise ValueError(
+                f"Unknown placement {placement!r}, expected one of {bulk_oxidation.PLACEMENTS}"
+            )
+
+        # Wall time of each stage and counters of the placements, returned as the record of the structure
+        stats = profiling.Stats()
+
         if disorder:
-            graphene = amorphous.select_disordered(p6, graphene)
+            import amorphous
+
+            with stats.stage("select"):
+                graphene = amorphous.select_disordered(p6, graphene, rng)
 
         if 8 in graphene.numbers:
             # delete the O atoms
@@ -50,61 +82,58 @@ class build:
             if 1 in graphene.numbers:
                 graphene = graphene[graphene.numbers != 1]
 
-        # Get the box size
-        box_size = graphene.get_cell().diagonal()
-
+        # Build the neighbour graph once, it is passed to (and kept up to date by) all the stages below
         if disorder and edges:
-            graphene = amorphous.cleave_amorphous(graphene, vacuum)
-
-        # Build NeighborList object
-        i, j = neighborlist.neighbor_list(
-            "i" "j", graphene, cutoff=1.85, self_interaction=False
-        )
-        nn_list = np.array((i, j)).T
+            # Cleaving builds the graph of the structure with vacuum added
+            with stats.stage("cleave"):
+                graphene, nn_graph, _ = amorphous.cleave_amorphous(graphene, vacuum)
+        else:
+            with stats.stage("neighbour_list"):
+                nn_graph = neighbours.NeighbourGraph.from_atoms(graphene, cutoff=1.85)
 
         if disorder and edges:
-            graphene = amorphous.saturate_amorphous(graphene, nn_list, box_size)
+            with stats.stage("saturate"):
+                graphene, nn_graph = amorphous.saturate_amorphous(graphene, nn_graph)
 
         # Run edge functionalisation if requested by user
         if edges:
-            # Get indices of H atoms from graphene sheet
-            h_atoms = np.array(np.where(graphene.get_atomic_numbers() == 1))[0][:]
-            # Store number of H atoms
-            N_hydrogen = h_atoms.shape[0]
-            # First we need to add the edge carbons to the oxidized carbon list, so we do not oxidise them again in the 2D code
-            edge_atoms = edge_oxidation.get_edge_carbons(graphene)
-            # Create neighbor list which contains the collision zone of each H atom
-            H = graphene[graphene.numbers == 1]
-            neighbors = (
-                np.array(neighborlist.neighbor_list("ij", H, 2.55)).T + h_atoms[0]
-            )
-            # Create a list to keep track of functionalised H atoms
-            funct_atoms = np.array([])
-            # Calculate number of each fuctional group to be added
-            N_groups = int(p4 * N_hydrogen)
-            # Add edge functionality to graphene
-            graphene, edge_atoms, N_edge_added = edge_oxidation.add_edge_functionality(
-                graphene,
-                edge_atoms,
-                h_atoms,
-                funct_groups,
-                1.4,
-                N_groups,
-                funct_atoms,
-                neighbors,
-                box_size[0],
-                max_iterations,
-            )
-            # We also need to calculate the number of bulk atoms so we know how many atoms we can oxidise later
-            bulk = graphene[[i for i in range(len(graphene)) if i not in edge_atoms]]
-            N_atoms = len(bulk)
+            import edge_oxidation
+
+            with stats.stage("edges"):
+                # Get indices of H atoms from graphene sheet
+                h_atoms = np.array(np.where(graphene.get_atomic_numbers() == 1))[0][:]
+                # Store number of H atoms
+                N_hydrogen = h_atoms.shape[0]
+                # First we need to add the edge carbons to the oxidized carbon list, so we do not oxidise them again in the 2D code
+                edge_atoms = edge_oxidation.get_edge_carbons(graphene)
+                # Create a mask to keep track of functionalised H atoms
+                funct_atoms = np.zeros(len(graphene), dtype=bool)
+                # Calculate number of each fuctional group to be added
+                N_groups = int(p4 * N_hydrogen)
+                # Add edge functionality to graphene
+                graphene, edge_atoms, N_edge_added = (
+                    edge_oxidation.add_edge_functionality(
+                        graphene,
+                        edge_atoms,
+                        h_atoms,
+                        funct_groups,
+                        1.4,
+                        N_groups,
+                        funct_atoms,
+                        max_iterations,
+                        rng,
+                        stats=stats,
+                    )
+                )
         else:
             # If no edges present we have no edge atoms and all atoms can be oxidised
-            edge_atoms = []
-            N_atoms = len(graphene)
+            edge_atoms = np.zeros(len(graphene), dtype=bool)
 
-        # Edge atoms are added to oxidised carbon list to avoid oxidising them
-        oxidised_atoms = edge_atoms
+        # Edge atoms (and the remaining edge H atoms) are left out of the carbons available for oxidation to
+        # avoid oxidising them; we also need the number of bulk atoms to know how many atoms we can oxidise
+        bulk = (graphene.numbers == 6) & ~edge_atoms
+        N_atoms = np.count_nonzero(bulk)
+        available = utilities.RandomSet(np.flatnonzero(bulk))
 
         # Oxygen content of the graphene oxide is dependant on the OH ratio
         # This is because the epoxy group will oxidise 2 carbon atoms whereas the hydroxyl group will oxidise 1 carbon atom
@@ -122,51 +151,103 @@ class build:
         # 1. Add the oxygen atoms above the carbon atoms at the midpoint of the bond (epoxy groups).
         # 2. Add the oxygen atoms above a carbon atom (hydroxyl groups)
 
-        (
-            graphene,
-            oxidised_atoms,
-            n_epoxy_added,
-            close_positions_up,
-            close_positions_down,
-        ) = bulk_oxidation.add_epoxy_group(
+        # Spatial index of the O and H atoms, used to find the atoms which can collide with each new group.
+        # Bins are sized to the largest collision cut off
+        index = spatial.CellList.from_atoms(
             graphene,
-            oxidised_atoms,
-            n_epoxy,
-            buckling_epoxy,
-            n_O,
-            n_OH,
-            N_atoms,
-            nn_list,
-            box_size,
-            max_iterations,
-        )
-        graphene, oxidised_atoms, n_OH_added = bulk_oxidation.add_hydroxyl_group(
-            graphene,
-            oxidised_atoms,
-            n_OH,
-            buckling_OH,
-            N_atoms,
-            nn_list,
-            close_positions_up,
-            close_positions_down,
-            max_iterations,
+            np.where(np.isin(graphene.numbers, [1, 8]))[0],
+            utilities.collision_thresholds().max(),
         )
 
-        graphene.rattle(0.02)
+        # Atoms are staged in a buffer while they are added and only materialised once at the end
+        graphene = buffer.AtomBuffer(graphene)
 
-        # Write the functionalised graphene oxide structure to a file
-        write(
-            output_structure,
-            graphene,
+        with stats.stage("epoxy"):
+            (
+                graphene,
+                available,
+                n_epoxy_added,
+            ) = bulk_oxidation.add_epoxy_group(
+                graphene,
+                available,
+                n_epoxy,
+                buckling_epoxy,
+                nn_graph,
+                max_iterations,
+                index,
+                rng,
+                stats=stats,
+            )
+        # Hydroxyl groups are either added one at a time or in batches checked for clashes all at once
+        if placement == "batch":
+            add_hydroxyl = bulk_oxidation.add_hydroxyl_groups_batch
+        else:
+            add_hydroxyl = bulk_oxidation.add_hydroxyl_group
+        with stats.stage("hydroxyl"):
+            graphene, available, n_OH_added = add_hydroxyl(
+                graphene,
+                available,
+                n_OH,
+                buckling_OH,
+                nn_graph,
+                index,
+                max_iterations,
+                rng,
+                size_policy,
+                max_atoms,
+                stats=stats,
+            )
+        graphene = graphene.to_atoms()
+
+        graphene.rattle(0.02, rng=rng)
+
+        # Number of groups added and requested, saved with the structure along with its parameters and seed
+        counts = {
+            "epoxy_added": n_epoxy_added,
+            "epoxy_requested": n_epoxy,
+            "hydroxyl_added": n_OH_added,
+            "hydroxyl_requested": n_OH,
+            "edge_added": N_edge_added if edges else 0,
+            "edge_requested": N_groups if edges else 0,
+        }
+        graphene.info.update(
+            seed=seed, O_content=O_content, OH_ratio=OH_ratio, p4=p4, **counts
         )
-
-        print(
+        # Amorphous structures keep the p6 value they were selected with from the database
+        graphene.info.setdefault("p6", p6)
+
+        # Write the functionalised graphene oxide structure to a file, or to a stream of structures
+        # (any object with a write method, e.g. sink.ExtxyzSink)
+        with stats.stage("write"):
+            if hasattr(output_structure, "write"):
+                output_structure.write(graphene)
+            else:
+                from ase.io import write
+
+                write(
+                    output_structure,
+                    graphene,
+                )
+
+        elapsed = time.time() - start_time
+        logger.info(
             "Successfully functionalised graphene to generate graphene oxide structure"
         )
-        print(f"Added {n_epoxy_added} epoxy groups out of {n_epoxy} requested")
-        print(f"Added {n_OH_added} hydroxyl groups out of {n_OH} requested")
+        logger.info("Added %d epoxy groups out of %d requested", n_epoxy_added, n_epoxy)
+        logger.info("Added %d hydroxyl groups out of %d requested", n_OH_added, n_OH)
         if edges:
-            print(f"Added {N_edge_added} edge groups out of {N_groups} requested")
-        print("Time taken: {:.2f} seconds".format(time.time() - start_time))
-
-        pass
+            logger.info(
+                "Added %d edge groups out of %d requested", N_edge_added, N_groups
+            )
+        logger.info("Time taken: %.2f seconds", elapsed)
+
+        # Machine-readable record of the structure, with the time spent in each stage
+        return stats.record(
+            output_structure=(
+                None if hasattr(output_structure, "write") else str(output_structure)
+            ),
+            seed=int(seed),
+            n_atoms=len(graphene),
+            total_time=elapsed,
+            **counts,
+        )
@@ -0,0 +1,220 @@
+"""_summary_
+Registry of the functional group templates. Each template is stored as frozen arrays of atomic numbers and
+positions (attached atom at the origin), so placing a group does not build an ase.Atoms object per trial.
+New chemistries are added by registering a template here, e.g.
+
+    register("nitro", "NOO", [(0, 0, 0), (1.09, 0, 0.63), (-1.09, 0, 0.63)])
+"""
+
+from math import cos, pi, sin
+
+import numpy as np
+from ase import Atoms
+from ase.symbols import symbols2numbers
+
+# Registered templates by name, in registration order
+REGISTRY = {}
+
+# Sites groups can be added to: edge groups replace an edge H atom (see edge_oxidation), basal groups are added
+# on the basal plane. Only epoxy and hydroxyl groups are placed on the basal plane so far, so no basal template
+# is registered until a placement stage uses them
+SITES = ("edge", "basal")
+
+
+class GroupTemplate:
+    """
+    Summary
+    ----------
+    Geometry of a functional group, with the atom bonded to the sheet placed at (0,0,0)
+
+    Parameters
+    ----------
+    name : str
+        Name of the group
+    symbols : str or list
+        Chemical symbols of the atoms (e.g. "COOH")
+    positions : numpy.ndarray
+        Positions of the atoms, the first one being bonded to the sheet
+    site : str
+        Where the group is added: "edge" (replacing an edge H atom) or "basal" (on the basal plane)
+    """
+
+    def __init__(self, name, symbols, positions, site="edge"):
+        self.name = name
+        self.site = site
+        self.numbers = np.array(symbols2numbers(symbols), dtype=int)
+        self.positions = np.array(positions, dtype=float).reshape(-1, 3)
+        if len(self.numbers) != len(self.positions):
+            raise ValueError(
+                f"Group {name!r} has {len(self.numbers)} symbols but {len(self.positions)} positions"
+            )
+        self.numbers.flags.writeable = False
+        self.positions.flags.writeable = False
+
+        # Positions mirrored to point along +x or -x, built once per orientation (the rotation angles of
+        # each placement are random, so only the orientation is cached)
+        self._oriented = {}
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __repr__(self):
+        return f"GroupTemplate({self.name!r}, site={self.site!r})"
+
+    def oriented(self, orientation):
+        """
+        Summary
+        ----------
+        Positions of the group pointing along +x or -x (built once per orientation, the returned array is
+        read-only)
+
+        Parameters
+        ----------
+        orientation : int
+            Direction the group points to, 1 or -1
+        """
+        if orientation not in self._oriented:
+            positions = self.positions * orientation
+            positions.flags.writeable = False
+            self._oriented[orientation] = positions
+        return self._oriented[orientation]
+
+    def to_atoms(self):
+        """
+        Summary
+        ----------
+        Build the ase.Atoms object of the group (e.g. to write or view it)
+        """
+        return Atoms(numbers=self.numbers, positions=self.positions)
+
+
+def register(name, symbols, positions, site="edge"):
+    """
+    Summary
+    ----------
+    Register a functional group template
+
+    Parameters
+    ----------
+    name : str
+        Name of the group, replacing any group registered with the same name
+    symbols : str or list
+        Chemical symbols of the atoms
+    positions : numpy.ndarray
+        Positions of the atoms, the first one being bonded to the sheet and placed at (0,0,0)
+    site : str, optional
+        "edge" (default) or "basal"
+    """
+    if site not in SITES:
+        raise ValueError(f"Unknown site {site!r}, expected one of {SITES}")
+    if np.any(np.asarray(positions, dtype=float).reshape(-1, 3)[0]):
+        raise ValueError(f"The first atom of group {name!r} must be placed at (0,0,0)")
+    template = GroupTemplate(name, symbols, positions, site)
+    REGISTRY[name] = template
+    return template
+
+
+def get(*names, site=None):
+    """
+    Summary
+    ----------
+    Get registered templates by name
+
+    Parameters
+    ----------
+    *names : str
+        Names of the groups
+    site : str, optional
+        If given, all the groups must be added at this site ("edge" or "basal")
+    """
+    missing = [name for name in names if name not in REGISTRY]
+    if missing:
+        raise KeyError(
+            f"Unknown functional groups {missing}, registered groups are {list(REGISTRY)}"
+        )
+    found = tuple(REGISTRY[name] for name in names)
+    if site is not None:
+        check_site(found, site)
+    return found
+
+
+def check_site(templates, site):
+    """
+    Summary
+    ----------
+    Check that functional groups can be added at a site
+
+    Parameters
+    ----------
+    templates : list
+        Templates of the groups
+    site : str
+        Site the groups are added at ("edge" or "basal")
+    """
+    wrong = [t.name for t in templates if t.site != site]
+    if wrong:
+        raise ValueError(
+            f"Functional groups {wrong} cannot be added at the {site} sites"
+        )
+
+
+def as_template(group):
+    """
+    Summary
+    ----------
+    Get the template of a functional group given either as a template or as an ase.Atoms object
+
+    Parameters
+    ----------
+    group : GroupTemplate or ase.Atoms
+        Functional group, with the atom bonded to the sheet at (0,0,0)
+    """
+    if isinstance(group, GroupTemplate):
+        return group
+    return GroupTemplate(
+        group.get_chemical_formula(), group.numbers, group.get_positions()
+    )
+
+
+def templates(site=None):
+    """
+    Summary
+    ----------
+    Get all the registered templates, optionally only the ones added at a given site
+
+    Parameters
+    ----------
+    site : str, optional
+        "edge" or "basal", by default all the templates
+    """
+    return tuple(t for t in REGISTRY.values() if site is None or t.site == site)
+
+
+# Edge groups (replacing an edge H atom), pointing along x with an approx 120 degree bond angle
+# Carboxyl group centered at (0,0,0)
+register(
+    "carboxyl",
+    "COOH",
+    [
+        (0, 0, 0),
+        (sin(5 * pi / 6) * 1.21, 0, cos(5 * pi / 6) * 1.21),
+        (sin(pi / 6) * 1.30, 0, cos(pi / 6) * 1.30),
+        (
+            sin(pi / 6) * 1.30 + sin(pi / 2) * 0.96,
+            0,
+            cos(pi / 6) * 1.30 + cos(pi / 2) * 0.96,
+        ),
+    ],
+)
+# Aldehyde group centered at (0,0,0)
+register(
+    "aldehyde",
+    "CHO",
+    [
+        (0, 0, 0),
+        (sin(5 * pi / 6) * 1.09, 0, cos(5 * pi / 6) * 1.09),
+        (sin(pi / 6) * 1.20, 0, cos(pi / 6) * 1.20),
+    ],
+)
+# OH group centered at (0,0,0)
+register("hydroxyl", "OH", [(0, 0, 0), (sin(pi / 6) * 0.96, 0, cos(pi / 6) * 0.96)])
@@ -0,0 +1,221 @@
+from collections import deque
+
+import numpy as np
+
+
+class NeighbourGraph:
+    """
+    Summary
+    ----------
+    Compact neighbour graph stored in compressed sparse row (CSR) format; the neighbours of atom i are
+    indices[indptr[i]:indptr[i + 1]]. Atoms can be removed from the graph, after which they are skipped
+    by all queries.
+
+    Parameters
+    ----------
+    indptr : numpy.ndarray
+        Offsets of the neighbours of each atom in indices
+    indices : numpy.ndarray
+        Neighbours of all atoms, grouped by atom
+    """
+
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+        # Atoms still present in the graph and their number of (present) neighbours
+        self.alive = np.ones(len(indptr) - 1, dtype=bool)
+        self.degrees = np.diff(indptr)
+        self.n_removed = 0
+
+    @classmethod
+    def from_neighbor_list(cls, i, j, n_atoms):
+        """
+        Summary
+        ----------
+        Build the neighbour graph from the pair arrays of ase.neighborlist.neighbor_list
+
+        Parameters
+        ----------
+        i : numpy.ndarray
+            First atom of each pair
+        j : numpy.ndarray
+            Second atom of each pair
+        n_atoms : int
+            Number of atoms in the structure
+        """
+        i = np.asarray(i, dtype=int)
+        order = np.argsort(i, kind="stable")
+        indptr = np.zeros(n_atoms + 1, dtype=int)
+        np.cumsum(np.bincount(i, minlength=n_atoms), out=indptr[1:])
+        return cls(indptr, np.asarray(j, dtype=int)[order])
+
+    @classmethod
+    def from_atoms(cls, atoms, cutoff=1.85):
+        """
+        Summary
+        ----------
+        Build the neighbour graph of a structure
+
+        Parameters
+        ----------
+        atoms : ase.Atoms
+            Structure to build the graph for
+        cutoff : float
+            Cut off for two atoms to be neighbours
+        """
+        # Imported here as it pulls in scipy, which dominates the start up time of the builder
+        from ase import neighborlist
+
+        i, j = neighborlist.neighbor_list(
+            "i" "j", atoms, cutoff=cutoff, self_interaction=False
+        )
+        return cls.from_neighbor_list(i, j, len(atoms))
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def pairs(self):
+        """
+        Summary
+        ----------
+        Get the (i, j) neighbour pairs between atoms still present in the graph
+        """
+        i = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        j = self.indices
+        if self.n_removed:
+            keep = self.alive[i] & self.alive[j]
+            i, j = i[keep], j[keep]
+        return i, j
+
+    def first_shell(self, atom):
+        """
+        Summary
+        ----------
+        Get the nearest neighbours of an atom (atoms added after the graph was built have no neighbours)
+
+        Parameters
+        ----------
+        atom : int
+            Index of the atom
+        """
+        if atom >= len(self):
+            return self.indices[:0]
+        neighbours = self.indices[self.indptr[atom] : self.indptr[atom + 1]]
+        if self.n_removed:
+            neighbours = neighbours[self.alive[neighbours]]
+        return neighbours
+
+    def second_shell(self, atom):
+        """
+        Summary
+        ----------
+        Get the atoms two bonds away from an atom (excluding the atom itself and its nearest neighbours)
+
+        Parameters
+        ----------
+        atom : int
+            Index of the atom
+        """
+        first = self.first_shell(atom)
+        if len(first) == 0:
+            return first
+        second = np.unique(np.concatenate([self.first_shell(n) for n in first]))
+        return second[(second != atom) & ~np.isin(second, first)]
+
+    def degree(self, atom=None):
+        """
+        Summary
+        ----------
+        Get the number of neighbours of an atom, or of every atom if no atom is given
+
+        Parameters
+        ----------
+        atom : int, optional
+            Index of the atom
+        """
+        if atom is None:
+            return self.degrees
+        if atom >= len(self):
+            return 0
+        return self.degrees[atom]
+
+    def remove_atom(self, atom):
+        """
+        Summary
+        ----------
+        Remove an atom from the graph, the coordination of its neighbours is updated accordingly
+
+        Parameters
+        ----------
+        atom : int
+            Index of the atom
+        """
+        if not self.alive[atom]:
+            return
+        np.subtract.at(self.degrees, self.first_shell(atom), 1)
+        self.degrees[atom] = 0
+        self.alive[atom] = False
+        self.n_removed += 1
+
+    def prune_dangling(self):
+        """
+        Summary
+        ----------
+        Repeatedly remove the atoms which have a single neighbour, until none are left. Atoms whose
+        neighbour count drops to one when a neighbour is removed are queued and removed in turn, so every
+        atom and bond is visited at most once.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean mask of the removed atoms
+        """
+        was_alive = self.alive.copy()
+        queue = deque(np.where(self.degrees == 1)[0].tolist())
+        while queue:
+            atom = queue.popleft()
+            # Atoms can have lost their last neighbour since they were queued (e.g. isolated pairs)
+            if self.degrees[atom] != 1:
+                continue
+            neighbours = self.first_shell(atom)
+            self.remove_atom(atom)
+            queue.extend(n for n in neighbours.tolist() if self.degrees[n] == 1)
+        return was_alive & ~self.alive
+
+    def compact(self):
+        """
+        Summary
+        ----------
+        Build a new graph without the removed atoms, in which the remaining atoms are renumbered in order
+        (i.e. matching structure[graph.alive])
+        """
+        new_index = np.cumsum(self.alive) - 1
+        i, j = self.pairs()
+        return NeighbourGraph.from_neighbor_list(
+            new_index[i], new_index[j], int(self.alive.sum())
+        )
+
+    def add_atoms(self, bonded_to):
+        """
+        Summary
+        ----------
+        Build a new graph with extra atoms appended to the end, each bonded to a single existing atom
+        (e.g. hydrogen atoms saturating the edges)
+
+        Parameters
+        ----------
+        bonded_to : numpy.ndarray
+            Index of the atom each new atom is bonded to
+        """
+        bonded_to = np.asarray(bonded_to, dtype=int)
+        new_atoms = len(self) + np.arange(len(bonded_to))
+        i, j = self.pairs()
+        graph = NeighbourGraph.from_neighbor_list(
+            np.concatenate([i, bonded_to, new_atoms]),
+            np.concatenate([j, new_atoms, bonded_to]),
+            len(self) + len(bonded_to),
+        )
+        # Atoms removed from this graph stay removed in the new one
+        graph.alive[: len(self)] = self.alive
+        graph.n_removed = self.n_removed
+        return graph
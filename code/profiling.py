@@ -0,0 +1,195 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+
+# Minimum number of seconds between two progress messages of a placement stage
+PROGRESS_INTERVAL = 5.0
+
+
+def configure_logging(level=logging.INFO, progress_interval=None):
+    """
+    Summary
+    ----------
+    Send the log messages of the builder to stderr (e.g. at the start of a run script)
+
+    Parameters
+    ----------
+    level : int, optional
+        Lowest level of the messages shown, by default logging.INFO (progress summaries);
+        logging.DEBUG also shows every rejected placement
+    progress_interval : float, optional
+        Minimum number of seconds between two progress messages, by default PROGRESS_INTERVAL
+    """
+    global PROGRESS_INTERVAL
+    logging.basicConfig(level=level, format="%(asctime)s %(name)s: %(message)s")
+    if progress_interval is not None:
+        PROGRESS_INTERVAL = progress_interval
+
+
+class Progress:
+    """
+    Summary
+    ----------
+    Progress of a placement stage, logged at most once every PROGRESS_INTERVAL seconds (and once the stage
+    is finished) along with the placement rate, instead of a message for every group added
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        Logger of the stage
+    name : str
+        Name of the groups being placed
+    total : int
+        Number of groups requested
+    """
+
+    def __init__(self, logger, name, total):
+        self.logger = logger
+        self.name = name
+        self.total = total
+        self.start = self.last = time.perf_counter()
+
+    def update(self, n_added):
+        """
+        Summary
+        ----------
+        Log the progress if it has not been logged for PROGRESS_INTERVAL seconds
+
+        Parameters
+        ----------
+        n_added : int
+            Number of groups added so far
+        """
+        now = time.perf_counter()
+        if now - self.last >= PROGRESS_INTERVAL:
+            self.last = now
+            self._log(n_added, now)
+
+    def finish(self, n_added):
+        """
+        Summary
+        ----------
+        Log the final number of groups added
+
+        Parameters
+        ----------
+        n_added : int
+            Number of groups added
+        """
+        self._log(n_added, time.perf_counter())
+
+    def _log(self, n_added, now):
+        elapsed = now - self.start
+        self.logger.info(
+            "Added %d/%d %s (%.2f%%, %.1f placements/s)",
+            n_added,
+            self.total,
+            self.name,
+            100 * n_added / self.total if self.total else 100.0,
+            n_added / elapsed if elapsed > 0 else 0.0,
+        )
+
+
+class Stats:
+    """
+    Summary
+    ----------
+    Wall time of each stage of a build and counters of the placement attempts, rejections, max iteration
+    exits and collision checks. The build stages add to it as they run and it is turned into a
+    machine-readable record once the structure is written.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = Counter()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Summary
+        ----------
+        Time a stage of the build (times of stages run more than once are added up)
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = (
+                self.timings.get(name, 0.0) + time.perf_counter() - start
+            )
+
+    def count(self, name, n=1):
+        """
+        Summary
+        ----------
+        Increment a counter
+
+        Parameters
+        ----------
+        name : str
+            Name of the counter
+        n : int, optional
+            Amount to add, by default 1
+        """
+        self.counters[name] += int(n)
+
+    def record(self, **info):
+        """
+        Summary
+        ----------
+        Build the record of the timings and counters, with any extra information about the structure
+
+        Parameters
+        ----------
+        **info
+            Extra entries of the record (e.g. seed, number of groups added)
+        """
+        # Numpy scalars (e.g. counts from np.count_nonzero) are converted to Python numbers, so that the
+        # record can always be written as JSON
+        return {
+            **{name: _builtin(value) for name, value in info.items()},
+            "timings": {name: float(t) for name, t in self.timings.items()},
+            "counters": {name: int(n) for name, n in self.counters.items()},
+        }
+
+
+def _builtin(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def aggregate(records):
+    """
+    Summary
+    ----------
+    Aggregate the records of many structures (e.g. a sweep): the total and mean time of each stage
+    and the total of each counter
+
+    Parameters
+    ----------
+    records : list
+        Records returned by Stats.record
+    """
+    timings = {}
+    counters = Counter()
+    for record in records:
+        for name, elapsed in record["timings"].items():
+            timings[name] = timings.get(name, 0.0) + elapsed
+        counters.update(record["counters"])
+
+    n_records = len(records)
+    return {
+        "structures": n_records,
+        "total_time": timings,
+        "mean_time": {name: elapsed / n_records for name, elapsed in timings.items()},
+        "counters": dict(counters),
+    }
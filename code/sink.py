@@ -0,0 +1,116 @@
+import io
+import os
+
+from database import index_frames
+
+# ase.io is only imported by the functions which read or write frames (see database.py), so that workers
+# sending their structures to a MemorySink never import it
+
+
+def read_jobs(path):
+    """
+    Summary
+    ----------
+    Read the job ids of the structures in an extxyz stream, without modifying it
+
+    Parameters
+    ----------
+    path : str
+        Path to the extxyz file (which may not exist yet)
+
+    Returns
+    -------
+    done : set
+        Job ids of the complete structures in the file
+    end : int
+        Byte offset of the end of the last complete structure
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done, 0
+    from ase.io.extxyz import key_val_str_to_dict
+
+    offsets, comments = index_frames(path)
+    for comment in comments:
+        job = key_val_str_to_dict(comment).get("job")
+        if job is not None:
+            done.add(str(job))
+    return done, int(offsets[-1])
+
+
+class ExtxyzSink:
+    """
+    Summary
+    ----------
+    Output stream which appends structures to a single extxyz file, instead of writing one file per structure.
+    Each structure is flushed (and synced to disk) once written, and a partially written last structure
+    (e.g. after a crash) is truncated when the file is opened again. Structures carrying a "job" id in their
+    info can be skipped when a sweep is resumed.
+
+    Parameters
+    ----------
+    path : str
+        Path to the extxyz file
+    fsync : bool, optional
+        If True (default), the file is synced to disk after every structure
+    """
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Job ids of the structures already in the file, the file is cut after the last complete structure
+        self.done, end = read_jobs(path)
+        self.file = open(path, "r+b" if os.path.exists(path) else "wb")
+        self.file.truncate(end)
+        self.file.seek(end)
+
+    def write(self, atoms):
+        """
+        Summary
+        ----------
+        Append a structure to the file
+
+        Parameters
+        ----------
+        atoms : ase.Atoms
+            Structure to write
+        """
+        from ase.io import write
+
+        frame = io.StringIO()
+        write(frame, atoms, format="extxyz")
+        self.file.write(frame.getvalue().encode())
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        if "job" in atoms.info:
+            self.done.add(str(atoms.info["job"]))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MemorySink:
+    """
+    Summary
+    ----------
+    Output which keeps the structures in memory (e.g. in a pool worker, which sends them back to the
+    process writing the stream)
+    """
+
+    def __init__(self):
+        self.structures = []
+
+    def write(self, atoms):
+        self.structures.append(atoms)
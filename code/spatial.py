@@ -0,0 +1,207 @@
+from itertools import product
+
+import numpy as np
+
+
+class CellList:
+    """
+    Summary
+    ----------
+    Binned spatial index (linked cells) of atom positions, used to find the atoms which can collide with a
+    newly placed atom without scanning the whole structure. Atoms can be added and removed as the structure grows.
+
+    Parameters
+    ----------
+    cell : numpy.ndarray
+        3x3 matrix of lattice vectors (rows)
+    pbc : list
+        Periodic directions of the cell
+    cutoff : float
+        Smallest bin width, should be the largest collision cut off
+    """
+
+    def __init__(self, cell, pbc, cutoff):
+        cell = np.array(cell, dtype=float)
+        # Zero length lattice vectors (e.g. non-periodic directions) are replaced so the cell can be inverted
+        for i in np.where(~cell.any(axis=1))[0]:
+            cell[i, i] = 1.0
+        self.cell = cell
+        self.inv_cell = np.linalg.inv(cell)
+        self.pbc = np.asarray(pbc, dtype=bool)
+        self.cutoff = cutoff
+
+        # Bins are sized with the perpendicular widths of the cell so that they are at least cutoff wide
+        volume = abs(np.linalg.det(cell))
+        heights = volume / np.linalg.norm(
+            np.cross(cell[[1, 2, 0]], cell[[2, 0, 1]]), axis=1
+        )
+        self.n_bins = np.maximum(1, np.floor(heights / cutoff)).astype(int)
+        self.bin_widths = heights / self.n_bins
+
+        # Atom indices stored in each bin and the bin of each stored atom
+        self.bins = {}
+        self.atom_bins = {}
+
+    @classmethod
+    def from_atoms(cls, atoms, indices, cutoff):
+        """
+        Summary
+        ----------
+        Build a spatial index containing the given atoms of a structure
+
+        Parameters
+        ----------
+        atoms : ase.Atoms
+            Structure containing the atoms
+        indices : list
+            Indices of the atoms to store
+        cutoff : float
+            Smallest bin width, should be the largest collision cut off
+        """
+        index = cls(atoms.get_cell(), atoms.pbc, cutoff)
+        positions = atoms.get_positions()
+        for i in indices:
+            index.add(i, positions[i])
+        return index
+
+    def __len__(self):
+        return len(self.atom_bins)
+
+    def __contains__(self, index):
+        return index in self.atom_bins
+
+    def _bins(self, positions):
+        # Bin coordinates of positions (periodic directions wrapped, others clipped to the outer bins)
+        fractional = np.asarray(positions, dtype=float) @ self.inv_cell
+        coords = np.floor(fractional * self.n_bins).astype(int)
+        return np.where(
+            self.pbc, coords % self.n_bins, np.clip(coords, 0, self.n_bins - 1)
+        )
+
+    def _bin(self, position):
+        return tuple(self._bins(position).tolist())
+
+    def add(self, index, position):
+        """
+        Summary
+        ----------
+        Add an atom to the spatial index
+
+        Parameters
+        ----------
+        index : int
+            Index of the atom in the structure
+        position : numpy.ndarray
+            Position of the atom
+        """
+        b = self._bin(position)
+        self.bins.setdefault(b, []).append(index)
+        self.atom_bins[index] = b
+
+    def remove(self, index):
+        """
+        Summary
+        ----------
+        Remove an atom from the spatial index
+
+        Parameters
+        ----------
+        index : int
+            Index of the atom in the structure
+        """
+        b = self.atom_bins.pop(index)
+        self.bins[b].remove(index)
+        if not self.bins[b]:
+            del self.bins[b]
+
+    def query(self, position, radius=None):
+        """
+        Summary
+        ----------
+        Get the atoms in the bins surrounding a position. All stored atoms within radius of the position
+        are returned (possibly along with some further away)
+
+        Parameters
+        ----------
+        position : numpy.ndarray
+            Position to search around
+        radius : float, optional
+            Search radius, by default the cut off used to size the bins
+        """
+        if radius is None:
+            radius = self.cutoff
+        centre = np.array(self._bin(position))
+        shells = np.ceil(radius / self.bin_widths).astype(int)
+
+        # Bin coordinates to visit along each direction
+        ranges = []
+        for axis in range(3):
+            coords = centre[axis] + np.arange(-shells[axis], shells[axis] + 1)
+            if self.pbc[axis]:
+                coords = np.unique(coords % self.n_bins[axis])
+            else:
+                coords = coords[(coords >= 0) & (coords < self.n_bins[axis])]
+            ranges.append(coords)
+
+        found = []
+        for b in product(*ranges):
+            if b in self.bins:
+                found.extend(self.bins[b])
+        return np.array(found, dtype=int)
+
+    def query_many(self, positions, radius=None, stored=None):
+        """
+        Summary
+        ----------
+        Vectorised version of query for many positions at once, which returns the candidate pairs instead
+        of one array of atoms per position
+
+        Parameters
+        ----------
+        positions : numpy.ndarray
+            Positions to search around, shape (N, 3)
+        radius : float, optional
+            Search radius, by default the cut off used to size the bins
+        stored : tuple, optional
+            Indices and positions of the atoms to search, by default the atoms stored in the index
+
+        Returns
+        -------
+        queries, atoms : numpy.ndarray
+            Position (row of positions) and atom of each candidate pair
+        """
+        if radius is None:
+            radius = self.cutoff
+        if stored is None:
+            atoms = np.fromiter(self.atom_bins, dtype=int, count=len(self))
+            coords = np.array(list(self.atom_bins.values()), dtype=int).reshape(-1, 3)
+        else:
+            atoms = np.asarray(stored[0], dtype=int)
+            coords = self._bins(stored[1]).reshape(-1, 3)
+
+        # Stored atoms sorted by the flat index of their bin, so each bin is a contiguous range
+        keys = np.ravel_multi_index(coords.T, self.n_bins)
+        order = np.argsort(keys, kind="stable")
+        keys, atoms = keys[order], atoms[order]
+
+        centres = self._bins(positions).reshape(-1, 3)
+        shells = np.ceil(radius / self.bin_widths).astype(int)
+
+        queries, found = [], []
+        for shift in product(*(range(-s, s + 1) for s in shells)):
+            coords = centres + shift
+            inside = np.all(self.pbc | ((coords >= 0) & (coords < self.n_bins)), axis=1)
+            flat = np.ravel_multi_index((coords[inside] % self.n_bins).T, self.n_bins)
+            start = np.searchsorted(keys, flat, side="left")
+            counts = np.searchsorted(keys, flat, side="right") - start
+            # Expand the [start, stop) range of each bin into the atoms it holds
+            offsets = np.arange(counts.sum()) - np.repeat(
+                np.cumsum(counts) - counts, counts
+            )
+            queries.append(np.repeat(np.where(inside)[0], counts))
+            found.append(atoms[np.repeat(start, counts) + offsets])
+
+        # Bins are visited more than once when the shells wrap around a small periodic cell
+        n_atoms = atoms.max() + 1 if len(atoms) else 1
+        pairs = np.unique(np.concatenate(queries) * n_atoms + np.concatenate(found))
+        return pairs // n_atoms, pairs % n_atoms
@@ -0,0 +1,360 @@
+"""_summary_
+This script runs a sweep over the structural parameters (p1-p4) and generates the graphene oxide structures
+in parallel over a pool of worker processes.
+"""
+
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from itertools import product
+
+import numpy as np
+import profiling
+import utilities
+from database import as_database
+from generate_GO import build
+from sink import ExtxyzSink, MemorySink, read_jobs
+
+logger = logging.getLogger(__name__)
+
+# Settings shared by all the jobs of a worker process (set once by the pool initializer)
+_worker_settings = None
+
+
+def parameter_grid(grid, output, repeats=1, seed=None):
+    """
+    Summary
+    ----------
+    Expand a grid of structural parameters into the list of jobs to run
+
+    Parameters
+    ----------
+    grid : dict
+        Values of each parameter to run over, with keys "O_content", "OH_ratio", "p6" and "p4"
+    output : str
+        Template of the output structure path, formatted with the parameters of each job and its batch
+        (e.g. "batch-{batch}/GO-{O_content:.2f}-{OH_ratio:.2f}.xyz")
+    repeats : int
+        Number of structures (batches) generated for each set of parameters
+    seed : int, optional
+        Seed of the sweep, each job gets its own seed spawned from it
+
+    Returns
+    -------
+    jobs : list
+        List of dictionaries with the parameters, seed and output path of each job
+    """
+    names = ("O_content", "OH_ratio", "p6", "p4")
+    combinations = list(product(range(repeats), *(grid[name] for name in names)))
+
+    # Each job gets an independent seed, which only depends on the sweep seed and its position in the sweep
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(combinations))
+
+    jobs = []
+    for (batch, *values), seed_sequence in zip(combinations, seed_sequences):
+        job = dict(zip(names, (float(v) for v in values)))
+        job["batch"] = batch
+        # 63 bit seeds, so that jobs of a large sweep are very unlikely to share a random stream
+        job["seed"] = utilities.random_seed(seed_sequence)
+        job["output_structure"] = output.format(**job)
+        jobs.append(job)
+    return jobs
+
+
+def _preload(settings):
+    # Import the modules the jobs need and build the read-only data they share (collision thresholds, p6
+    # index of the database) once in the main process; forked workers inherit them instead of each
+    # loading them again when they start
+    modules = ["ase.neighborlist"]
+    if settings["disorder"]:
+        modules.append("amorphous")
+    if settings["edges"]:
+        modules.append("edge_oxidation")
+    # Frames of the amorphous database are parsed, and structures written to files, with ase.io
+    if settings["disorder"] or not settings["sink"]:
+        modules.append("ase.io")
+    for name in modules:
+        importlib.import_module(name)
+
+    utilities.collision_thresholds()
+    if hasattr(settings["graphene"], "p6_index"):
+        settings["graphene"].p6_index
+
+
+def _init_worker(settings):
+    global _worker_settings
+    _worker_settings = settings
+    if settings["quiet"]:
+        # Silence the workers (warnings included), the record of each structure keeps the counts of
+        # groups added and of max iteration exits
+        logging.disable(logging.WARNING)
+
+
+def build_job(job, settings, output):
+    """
+    Summary
+    ----------
+    Build the structure of a single job
+
+    Parameters
+    ----------
+    job : dict
+        Parameters, seed and output path of the job (see parameter_grid)
+    settings : dict
+        Settings shared by all the jobs of the sweep (arguments of run_sweep)
+    output : str or sink.MemorySink
+        Path the structure is written to, or sink it is sent to
+
+    Returns
+    -------
+    record : dict
+        Record of the build (see generate_GO.build.main)
+    """
+    graphene = settings["graphene"]
+    if not settings["disorder"]:
+        # We need a copy of initial structure to avoid oxidising the same strucuture twice.
+        graphene = graphene.copy()
+
+    return build().main(
+        graphene,
+        job["O_content"],
+        job["OH_ratio"],
+        settings["disorder"],
+        job["p6"],
+        settings["edges"],
+        job["p4"],
+        settings["funct_groups"],
+        settings["vacuum"],
+        settings["max_iterations"],
+        output,
+        settings["size_policy"],
+        settings["max_atoms"],
+        job["seed"],
+        settings["placement"],
+    )
+
+
+def _run_job(job):
+    settings = _worker_settings
+    start_time = time.time()
+
+    if settings["sink"]:
+        # The structure is sent back to the main process, which appends it to the output stream
+        output = MemorySink()
+    else:
+        # Write to a temporary file first and move it in place once complete, so that a crash never leaves
+        # a partial structure behind (it would be skipped when the sweep is resumed)
+        output_structure = job["output_structure"]
+        directory, name = os.path.split(output_structure)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        output = os.path.join(directory, f".tmp-{os.getpid()}-{name}")
+
+    record = build_job(job, settings, output)
+    if settings["sink"]:
+        atoms = output.structures[0]
+        # The job id is what a resumed sweep looks for in the stream
+        atoms.info["job"] = job["output_structure"]
+    else:
+        os.replace(output, output_structure)
+        atoms = None
+
+    # The record of the structure is returned with the parameters of the job
+    record.update(job)
+    record["job_time"] = time.time() - start_time
+    return record, atoms
+
+
+def run_sweep(
+    graphene,
+    grid,
+    disorder,
+    edges,
+    funct_groups,
+    vacuum,
+    max_iterations,
+    output,
+    repeats=1,
+    workers=None,
+    seed=None,
+    size_policy="warn",
+    max_atoms=300,
+    placement="sequential",
+    profile=None,
+    quiet=True,
+    sink=None,
+    start_method=None,
+):
+    """
+    Summary
+    ----------
+    Generate a graphene oxide structure for every set of parameters in a grid, in parallel.
+    Structures which have already been written are skipped, so an interrupted sweep can be resumed
+    by running it again (with the same seed). Structures are either written to one file each, or
+    appended to a single extxyz stream (sink).
+
+    Parameters
+    ----------
+    graphene : ase.Atoms or list
+        Graphene structure (or database of amorphous structures if disorder is True, a list of structures is
+        wrapped in a database.StructureList so that its p6 index is only built once)
+    grid : dict
+        Values of each parameter to run over, with keys "O_content", "OH_ratio", "p6" and "p4"
+    disorder : bool
+        If True, structures are selected from the amorphous database
+    edges : bool
+        If True, the edges are functionalised
+    funct_groups : ase.Atoms list
+        List of atoms object containing possible functinal groups to be added to the edges
+    vacuum : float
+        Vacuum along the direction of the edges
+    max_iterations : int
+        Maximum number of iterations to try and add a group
+    output : str
+        Template of the output structure path (see parameter_grid), which is also the id of each structure
+        in the stream if a sink is given
+    repeats : int
+        Number of structures (batches) generated for each set of parameters
+    workers : int, optional
+        Number of worker processes, by default the number of CPUs
+    seed : int, optional
+        Seed of the sweep, by default a random one is drawn (and printed)
+    size_policy : str, optional
+        What to do when a structure exceeds max_atoms ("warn", "stop" or "continue"), by default "warn"
+    max_atoms : int, optional
+        Size budget of each structure, by default 300 atoms
+    placement : str, optional
+        How the hydroxyl groups are placed ("sequential" or "batch"), by default "sequential"
+    profile : str, optional
+        Path of a JSON file to write the record of every structure generated (timings of each stage and
+        counters) along with their aggregate, by default nothing is written. The records of a resumed
+        sweep are merged with the ones already in the file
+    quiet : bool, optional
+        If True (default), the worker processes do not log anything below errors, only the progress of
+        the sweep is logged
+    sink : str, optional
+        Path of a single extxyz file all the structures are appended to (see sink.ExtxyzSink), instead of
+        one file per structure, by default None
+    start_method : str, optional
+        How the worker processes are started ("fork", "spawn" or "forkserver"), by default "fork" on Linux
+        (workers inherit the modules and data preloaded by the main process) and the platform default
+        elsewhere (e.g. spawn on macOS, where forking is unsafe)
+    """
+    start_time = time.time()
+
+    if seed is None:
+        seed = utilities.random_seed()
+    logger.info("Sweep seed: %d", seed)
+
+    jobs = parameter_grid(grid, output, repeats, seed)
+    if sink is not None:
+        # The stream itself is only opened once the workers have started, so they do not inherit it
+        done = read_jobs(sink)[0]
+        todo = [job for job in jobs if job["output_structure"] not in done]
+    else:
+        todo = [job for job in jobs if not os.path.exists(job["output_structure"])]
+    logger.info(
+        "Running %d jobs (%d of %d already done)",
+        len(todo),
+        len(jobs) - len(todo),
+        len(jobs),
+    )
+
+    if disorder:
+        graphene = as_database(graphene)
+    settings = {
+        "graphene": graphene,
+        "disorder": disorder,
+        "edges": edges,
+        "funct_groups": funct_groups,
+        "vacuum": vacuum,
+        "max_iterations": max_iterations,
+        "size_policy": size_policy,
+        "max_atoms": max_atoms,
+        "placement": placement,
+        "quiet": quiet,
+        "sink": sink is not None,
+    }
+
+    # Workers are forked on Linux (spawn or forkserver is the default of some Python versions), so that they
+    # start with the preloaded modules and data and the settings are not pickled
+    if start_method is None and sys.platform.startswith("linux"):
+        start_method = "fork"
+    if start_method is not None:
+        if start_method not in multiprocessing.get_all_start_methods():
+            raise ValueError(
+                f"Unknown start method {start_method!r}, expected one of "
+                f"{multiprocessing.get_all_start_methods()}"
+            )
+        context = multiprocessing.get_context(start_method)
+    else:
+        context = None
+    _preload(settings)
+
+    n_done = 0
+    records = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(settings,),
+    ) as pool:
+        # Submitting the jobs starts the workers
+        futures = [pool.submit(_run_job, job) for job in todo]
+        stream = ExtxyzSink(sink) if sink is not None else nullcontext()
+        with stream:
+            for future in as_completed(futures):
+                record, atoms = future.result()
+                if atoms is not None:
+                    stream.write(atoms)
+                records.append(record)
+                n_done += 1
+                logger.info(
+                    "Finished %d/%d: %s (%.2f seconds)",
+                    n_done,
+                    len(todo),
+                    record["output_structure"],
+                    record["job_time"],
+                )
+
+    elapsed = time.time() - start_time
+    logger.info(
+        "Generated %d structures in %.2f seconds (%.2f structures/s)",
+        n_done,
+        elapsed,
+        n_done / elapsed,
+    )
+
+    if profile is not None:
+        # A resumed sweep keeps the records of the structures built by the earlier runs (keyed by job id,
+        # a job run again replaces its old record), and the elapsed time adds up over the runs
+        merged = {}
+        if os.path.exists(profile):
+            with open(profile) as f:
+                previous = json.load(f)
+            merged = {r["output_structure"]: r for r in previous["records"]}
+            elapsed += previous["elapsed"]
+        merged.update((r["output_structure"], r) for r in records)
+        records = list(merged.values())
+
+        # Written to a temporary file first and moved in place, so a failed write never leaves a partial profile
+        tmp_profile = f"{profile}.{os.getpid()}.tmp"
+        with open(tmp_profile, "w") as f:
+            json.dump(
+                {
+                    "seed": int(seed),
+                    "elapsed": elapsed,
+                    "summary": profiling.aggregate(records),
+                    "records": records,
+                },
+                f,
+                indent=2,
+            )
+        os.replace(tmp_profile, profile)
+    return jobs
@@ -1,15 +1,194 @@
-import math
+from functools import lru_cache
+from itertools import product
 
 import numpy as np
 
+# Image shifts of the 26 neighbouring cells (plus the home cell) for triclinic minimum image
+IMAGE_SHIFTS = np.array(list(product((-1, 0, 1), repeat=3)), dtype=float)
 
-# check if this is needed or not
-def minimum_image(vector, box_size):
-    # Apply the periodic boundary conditions to the vector
-    for i in range(3):
-        if abs(vector[i]) > box_size[i] / 2:
-            vector[i] -= box_size[i] * round(vector[i] / box_size[i])
-    return vector
+
+def random_seed(seed_sequence=None):
+    """
+    Summary
+    ----------
+    Draw a 63 bit seed, which fits in the int64 the seed is read back as from the info of a structure
+    (SeedSequence().entropy is 128 bit and comes back as a float, so the structure could not be regenerated)
+
+    Parameters
+    ----------
+    seed_sequence : numpy.random.SeedSequence, optional
+        Seed sequence to draw the seed from, by default a fresh one seeded from the OS entropy
+    """
+    if seed_sequence is None:
+        seed_sequence = np.random.SeedSequence()
+    return int(seed_sequence.generate_state(1, np.uint64)[0] >> 1)
+
+
+@lru_cache(maxsize=None)
+def collision_thresholds(r_c=1.85 / 2, r_o=1.52 / 2, r_h=1.2 / 2):
+    """
+    Summary
+    ----------
+    Build the matrix of collision cut offs indexed by the atomic numbers of both atoms
+
+    Parameters
+    ----------
+    r_c:
+        Hard sphere radius for carbon (Default value is VdW radius)
+    r_o:
+        Hard sphere radius for oxygen (Default value is VdW radius)
+    r_h:
+        Hard sphere radius for hydrogen (Default value is VdW radius)
+    """
+    radii = np.zeros(119)
+    radii[[1, 6, 8]] = r_h, r_c, r_o
+    # Cut off for each pair is the sum of the two hard sphere radii
+    thresholds = radii[:, None] + radii[None, :]
+    thresholds.flags.writeable = False
+    return thresholds
+
+
+@lru_cache(maxsize=128)
+def reduced_cell(cell, pbc):
+    """
+    Summary
+    ----------
+    Minkowski reduce the periodic lattice vectors of a cell (built once per cell, the reduction is much
+    slower than a collision check)
+
+    Parameters
+    ----------
+    cell : bytes
+        3x3 matrix of lattice vectors (rows), as the bytes of a float array so that it can be cached
+    pbc : tuple
+        Periodic directions of the cell
+    """
+    from ase.geometry import minkowski_reduce
+
+    reduced = minkowski_reduce(np.frombuffer(cell).reshape(3, 3), pbc)[0]
+    reduced.flags.writeable = False
+    return reduced
+
+
+def minimum_image_vectors(vectors, cell, pbc=(True, True, True)):
+    """
+    Summary
+    ----------
+    Apply the minimum image convention to separation vectors for a general (triclinic) cell
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        Array of separation vectors with shape (..., 3)
+    cell : numpy.ndarray
+        3x3 matrix of lattice vectors (rows)
+    pbc : list
+        Periodic directions of the cell
+    """
+    vectors = np.asarray(vectors, dtype=float)
+    cell = np.asarray(cell, dtype=float)
+    pbc = np.asarray(pbc, dtype=bool) & np.any(cell != 0, axis=1)
+    if not pbc.any():
+        return vectors
+
+    # Orthogonal cells are already reduced, skewed ones are Minkowski reduced (same lattice, shortest
+    # periodic vectors) so that the shortest image is always in one of the neighbouring cells
+    orthogonal = np.allclose(cell - np.diag(cell.diagonal()), 0)
+    if not orthogonal:
+        cell = reduced_cell(cell.tobytes(), tuple(pbc.tolist()))
+
+    # Non-periodic lattice vectors are replaced by unit vectors orthogonal to the periodic ones,
+    # so that wrapping along the periodic directions is not skewed by them
+    cell_full = cell.copy()
+    if not pbc.all():
+        _, _, vt = np.linalg.svd(cell[pbc])
+        cell_full[~pbc] = vt[pbc.sum() :]
+
+    # Wrap the vectors into the home cell in fractional coordinates (only along periodic directions)
+    fractional = vectors @ np.linalg.inv(cell_full)
+    fractional[..., pbc] -= np.round(fractional[..., pbc])
+    wrapped = fractional @ cell_full
+
+    # For orthogonal cells the wrapped vector is already the shortest image
+    if orthogonal:
+        return wrapped
+
+    # Skewed cells need the neighbouring images checked as well
+    shifts = IMAGE_SHIFTS[np.all(IMAGE_SHIFTS[:, ~pbc] == 0, axis=1)] @ cell_full
+    images = wrapped[..., None, :] + shifts
+    shortest = np.argmin(np.einsum("...ij,...ij->...i", images, images), axis=-1)
+    return np.take_along_axis(images, shortest[..., None, None], axis=-2)[..., 0, :]
+
+
+def minimum_image_distances(vectors, cell, pbc=(True, True, True)):
+    """
+    Summary
+    ----------
+    Length of separation vectors under the minimum image convention for a general (triclinic) cell
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        Array of separation vectors with shape (..., 3)
+    cell : numpy.ndarray
+        3x3 matrix of lattice vectors (rows)
+    pbc : list
+        Periodic directions of the cell
+    """
+    return np.linalg.norm(minimum_image_vectors(vectors, cell, pbc), axis=-1)
+
+
+def valid_placements(
+    graphene,
+    group_positions,
+    group_numbers,
+    collision_zone,
+    r_c=1.85 / 2,
+    r_o=1.52 / 2,
+    r_h=1.2 / 2,
+):
+    """
+    Summary
+    ----------
+    Screen many candidate placements of a functional group against the collision zone in one call
+
+    Parameters
+    ----------
+    graphene : ase.Atoms
+        Graphene structure
+    group_positions : numpy.ndarray
+        Positions of the group atoms for each candidate placement, shape (N_candidates, N_group, 3)
+    group_numbers : numpy.ndarray
+        Atomic numbers of the group atoms
+    collision_zone : list
+        Indices of atoms that can collide with functional group
+    r_c:
+        Hard sphere radius for carbon (Default value is VdW radius)
+    r_o:
+        Hard sphere radius for oxygen (Default value is VdW radius)
+    r_h:
+        Hard sphere radius for hydrogen (Default value is VdW radius)
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask which is True for each candidate placement without close contacts
+    """
+    group_positions = np.asarray(group_positions, dtype=float)
+    collision_zone = np.asarray(collision_zone, dtype=int)
+    # If collision zone is empty then every placement is valid
+    if len(collision_zone) == 0:
+        return np.ones(len(group_positions), dtype=bool)
+
+    zone_positions = graphene.get_positions()[collision_zone]
+    # Cut offs for every (group atom, collision zone atom) pair
+    thresholds = collision_thresholds(r_c, r_o, r_h)[
+        np.asarray(group_numbers)[:, None], graphene.numbers[collision_zone][None, :]
+    ]
+
+    vectors = group_positions[:, :, None, :] - zone_positions[None, None, :, :]
+    distances = minimum_image_distances(vectors, graphene.get_cell(), graphene.pbc)
+    return ~np.any(distances <= thresholds, axis=(1, 2))
 
 
 def is_structure_valid(
@@ -35,40 +214,129 @@ def is_structure_valid(
     r_h:
         Hard sphere radius for hydrogen (Default value is VdW radius)
     """
-    # Cut offs for checking for collisions
-    threshholds = {
-        "CC": r_c * 2,
-        "OO": r_o * 2,
-        "HH": r_h * 2,
-        "HC": r_c + r_h,
-        "CH": r_c + r_h,
-        "OH": r_o + r_h,
-        "HO": r_o + r_h,
-        "CO": r_c + r_o,
-        "OC": r_c + r_o,
-    }
     # If collision zone is empty then structure is valid
     if len(collision_zone) == 0:
         return True
 
-    # Loop over pairs to check for collisions
-    for atom in group:
-        for i in collision_zone:
-            pair = graphene[i].symbol + atom.symbol
-            atom_1 = np.array(graphene[i].position)
-            atom_2 = np.array(atom.position)
-            # Apply minimum image convention
-            dx = abs(atom_1[0] - atom_2[0])
-            dx = min(dx, graphene.get_cell()[0, 0] - dx)
-            dy = abs(atom_1[1] - atom_2[1])
-            dy = min(dy, graphene.get_cell()[1, 1] - dy)
-            dz = abs(atom_1[2] - atom_2[2])
-            dz = min(dz, graphene.get_cell()[2, 2] - dz)
-
-            # Calculate distance between atoms
-            min_dist = math.sqrt(dx**2 + dy**2 + dz**2)
-
-            # Check min distance
-            if min_dist <= threshholds[pair]:
-                return False
+    # Group can either be an ase.Atoms object or a list of ase.Atom objects
+    group_positions = np.array([atom.position for atom in group], dtype=float)
+    group_numbers = np.array([atom.number for atom in group], dtype=int)
+
+    zone = np.asarray(collision_zone, dtype=int)
+    zone_positions = graphene.get_positions()[zone]
+    zone_thresholds = collision_thresholds(r_c, r_o, r_h)[:, graphene.numbers[zone]]
+    cell = graphene.get_cell()
+
+    # Check one group atom at a time against the whole collision zone and stop at the first clash
+    for position, number in zip(group_positions, group_numbers):
+        distances = minimum_image_distances(
+            zone_positions - position, cell, graphene.pbc
+        )
+        if np.any(distances <= zone_thresholds[number]):
+            return False
     return True
+
+
+class RandomSet:
+    """
+    Summary
+    ----------
+    Set of non-negative integers (e.g. indices of the carbon atoms which can still be oxidised) with O(1)
+    membership test, removal and random draw. Items are kept in an array and removed items are swapped
+    with the last one, with a map from item to its position in the array.
+
+    Parameters
+    ----------
+    items : list
+        Initial items of the set
+    """
+
+    def __init__(self, items):
+        items = np.unique(np.asarray(items, dtype=int))
+        self.items = items.copy()
+        self.size = len(items)
+        # Position of each item in the items array (-1 if item is not in the set)
+        self.position = np.full(items.max() + 1 if self.size else 0, -1, dtype=int)
+        self.position[items] = np.arange(self.size)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, item):
+        return 0 <= item < len(self.position) and self.position[item] >= 0
+
+    def __iter__(self):
+        return iter(self.items[: self.size].tolist())
+
+    def isin(self, items):
+        """
+        Summary
+        ----------
+        Vectorised membership test of many items
+
+        Parameters
+        ----------
+        items : numpy.ndarray
+            Items to look up
+        """
+        items = np.asarray(items, dtype=int)
+        inside = (items >= 0) & (items < len(self.position))
+        inside[inside] = self.position[items[inside]] >= 0
+        return inside
+
+    def remove(self, item):
+        """
+        Summary
+        ----------
+        Remove an item from the set by swapping it with the last item
+
+        Parameters
+        ----------
+        item : int
+            Item to remove
+        """
+        i = self.position[item]
+        last = self.items[self.size - 1]
+        self.items[i] = last
+        self.position[last] = i
+        self.items[self.size - 1] = item
+        self.position[item] = -1
+        self.size -= 1
+
+    def add(self, item):
+        """
+        Summary
+        ----------
+        Add an item to the set (e.g. an item which was removed and can be drawn again)
+
+        Parameters
+        ----------
+        item : int
+            Item to add
+        """
+        if item in self:
+            return
+        if item >= len(self.position):
+            self.position = np.concatenate(
+                [self.position, np.full(item + 1 - len(self.position), -1, dtype=int)]
+            )
+        if self.size == len(self.items):
+            self.items = np.concatenate(
+                [self.items, np.zeros(max(self.size, 1), dtype=int)]
+            )
+        self.items[self.size] = item
+        self.position[item] = self.size
+        self.size += 1
+
+    def choice(self, rng):
+        """
+        Summary
+        ----------
+        Draw a random item from the set (the item is not removed)
+
+        Parameters
+        ----------
+        rng : numpy.random.Generator
+            Random number generator
+        """
+        return self.items[rng.integers(self.size)]